@@ -1,10 +1,102 @@
 import carla
-import time
 import logging
 import inspect
+import argparse
+
+from async_log_writer import format_log_stats, start_async_logging
+from map_geometry_cache import ensure_map_geometry_cache
+from state_recorder import StateRecorder
+from tick_scheduler import OVERRUN_POLICIES, TICK_MODES, TickScheduler, format_tick_stats
+
+LOG_FILE_PATH = 'myapp6.log'
+RECORD_FILE_PATH = 'myapp6.rec'
+
+
+def log_map_header(map_instance, map_geometry_cache):
+    # 记录一条日志
+    logging.debug('这是一条debug日志')
+    logging.debug("name: %s", map_instance.name)
+    # 日志中只记录地图几何缓存文件的路径，segment_split_plus.py 直接读取该文件
+    logging.debug("map_geometry_cache: %s", map_geometry_cache)
+    # 分隔 map_crosswalks（内容在缓存文件中）
+    logging.debug("+" * 70)
+    # 分隔 junctions（内容在缓存文件中）
+    logging.debug("+" * 70)
+
+    logging.debug("*" * 90)
+
+
+def log_frame(pt, vehicles, traffic_lights, traffic_signs, pedestrians, map_instance):
+    # 日志使用 logging.debug("%s: %s", key, value) 的形式，消息字符串由写入线程格式化，不占用采集循环的时间
+    logging.debug("Time: %.2fs", pt)
+
+    # 循环输出车辆信息
+    for vehicle in vehicles:
+        # json_string = json.dumps(vehicle)
+        # print(f"Vehicle attr: {vars(vehicle)}")
+        # print(f"Vehicle : {json_string}")
+        # 移除不存在的属性调用
+        # print(f"Vehicle Is Invincible: {vehicle.is_invincible}")
+        # print(f"Vehicle Is Destroyed: {vehicle.is_destroyed}")
+        # print(f"Vehicle Speed Limit: {vehicle.get_speed_limit()}")
+        # print("-" * 80)
+
+        logging.debug("Vehicle_ID: %s", vehicle.id)
+        logging.debug("Vehicle_Type: %s", vehicle.type_id)
+        logging.debug("Vehicle_Location: %s", vehicle.get_location())
+        logging.debug("Vehicle_Velocity: %s", vehicle.get_velocity())
+        logging.debug("Vehicle_Acceleration: %s", vehicle.get_acceleration())
+        logging.debug("Vehicle_Angular_Velocity: %s", vehicle.get_angular_velocity())
+        logging.debug("Vehicle_Attributes: %s", vehicle.attributes)
+
+        logging.debug("traffic_light: %s", vehicle.get_traffic_light())
+        logging.debug("traffic_light_state: %s", vehicle.get_traffic_light_state())
+        logging.debug("transform: %s", vehicle.get_transform())
+        # logging.debug(f"wheel_steer_angle: {vehicle.get_wheel_steer_angle()}")
+        # 是否受到路灯影响
+        logging.debug("vehicle_is_at_traffic_light: %s", vehicle.is_at_traffic_light())
+        logging.debug("Vehicle_Velocity_value: %s", vehicle.get_velocity().length())
+        # 获取车辆控制信息
+        vehicle_control = vehicle.get_control()
+        # 获取方向盘的偏转角度
+        steering_angle = vehicle_control.steer
+        logging.debug("Vehicle_steering_angle: %s", steering_angle)
+
+        # 移除不存在的属性调用
+        # print(f"Vehicle Is Invincible: {vehicle.is_invincible}")
+        # print(f"Vehicle Is Destroyed: {vehicle.is_destroyed}")
+        logging.debug("Vehicle_Speed_Limit: %s", vehicle.get_speed_limit())
+
+        logging.debug("-" * 40)
+        for key, value in inspect.getmembers(vehicle):
+            if not key.startswith('__'):
+                logging.debug("%s: %s", key, value)
+
+        # 使用 "-" * 60 分隔每一辆车的信息
+        logging.debug("-" * 60)
+
+    # 使用 "*" * 70 分隔车辆信息与信号灯信息
+    logging.debug("*" * 70)
+
+    # 循环输出交通信号灯信息
+    for tls in traffic_lights:
+        logging.debug("Location: %s", tls.get_location())
+        for key, value in inspect.getmembers(tls):
+            if not key.startswith('__'):
+                logging.debug("%s: %s", key, value)
+        # 使用 "+" * 40 分隔每一个信号灯信息
+        logging.debug("+" * 40)
+
+    # 使用 "+" * 70 分隔信号灯信息
+
+    # 使用 "*" * 80 分隔每一帧
+    logging.debug("*" * 80)
 
 
-def main():
+def main(record_binary=False, tick_mode='wall', policy='skip'):
+    recorder = None
+    log_handler = None
+    scheduler = None
     try:
         # 连接到CARLA服务器
         client = carla.Client('localhost', 2000)
@@ -15,46 +107,37 @@ def main():
         blueprint_library = world.get_blueprint_library()
         map_instance = world.get_map()
 
-        # 配置日志级别、格式和文件名
-        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s',
-                            filename='myapp6.log')
-
-        # 记录一条日志
-        logging.debug('这是一条debug日志')
-        for key, value in inspect.getmembers(map_instance):
-            if not key.startswith('__'):
-                logging.debug(f"{key}: {value}")
-
-        map_crosswalks = map_instance.get_crosswalks()
-        logging.debug(f"map_crosswalks_length: {len(map_crosswalks)}")
-        logging.debug("+" * 70)
-        for crosswalk in map_crosswalks:
-            for key, value in inspect.getmembers(crosswalk):
-                if not key.startswith('__'):
-                    logging.debug(f"{key}: {value}")
-
-            # 使用 "+" * 60 分隔每一个crosswalk的信息
-            logging.debug("+" * 60)
-
-        logging.debug("*" * 90)
+        # 人行横道、交叉路口、信号灯位置按地图缓存成二进制文件，只有第一次采集该地图时才需要计算
+        map_geometry_cache = ensure_map_geometry_cache(world, map_instance)
+        if record_binary:
+            # 二进制状态记录：每个actor只写固定格式的字段，不再逐个输出 inspect.getmembers
+            recorder = StateRecorder(RECORD_FILE_PATH, {'name': map_instance.name,
+                                                        'map_geometry_cache': map_geometry_cache})
+        else:
+            # 日志由后台线程格式化并写入文件，磁盘慢时不影响采集的时间间隔
+            log_handler = start_async_logging(LOG_FILE_PATH)
+            log_map_header(map_instance, map_geometry_cache)
 
         # 设置一个持续5分钟的计时器 5 * 60
         duration = 1 * 20
-        start_time = time.time()
-
+        # 每0.5秒采样一次，按固定的时间点调度，处理超时时按 policy 跳过或追赶
         step_time = 0.5
-
-        while time.time() - start_time < duration:
+        # 同步模式下 Traffic Manager 也要切换到同步模式，退出时由调度器恢复
+        traffic_manager = client.get_trafficmanager() if tick_mode == 'sync' else None
+        # 只有二进制记录使用快照，文本日志不需要每帧额外请求一次
+        scheduler = TickScheduler(step_time, duration, policy=policy, mode=tick_mode, world=world,
+                                  traffic_manager=traffic_manager, want_snapshot=record_binary)
+        # 二进制记录时 snapshot 为本帧的 world.get_snapshot()，所有actor的运动状态只请求一次
+        for pt, snapshot in scheduler:
             # 时间信息
-            pt = time.time() - start_time
             print(f"Time: {pt:.2f}s")
-            logging.debug(f"Time: {pt:.2f}s")
 
             # 获取所有车辆、行人和交通信号灯
-            vehicles = world.get_actors().filter('vehicle.*')
-            pedestrians = world.get_actors().filter('walker.pedestrian.*')
-            traffic_lights = world.get_actors().filter('traffic.traffic_light')
-            traffic_signs = world.get_actors().filter('traffic.sign.*', exclude_TrafficLight=True)
+            actors = world.get_actors()
+            vehicles = actors.filter('vehicle.*')
+            pedestrians = actors.filter('walker.pedestrian.*')
+            traffic_lights = actors.filter('traffic.traffic_light')
+            traffic_signs = actors.filter('traffic.sign.*', exclude_TrafficLight=True)
 
             # 输出信息
             print(f"Vehicles: {len(vehicles)}")
@@ -62,76 +145,38 @@ def main():
             print(f"Traffic Lights: {len(traffic_lights)}")
             print(f"Traffic Signs: {len(traffic_signs)}")
 
-            # 循环输出车辆信息
-            for vehicle in vehicles:
-                # json_string = json.dumps(vehicle)
-                # print(f"Vehicle attr: {vars(vehicle)}")
-                # print(f"Vehicle : {json_string}")
-                # 移除不存在的属性调用
-                # print(f"Vehicle Is Invincible: {vehicle.is_invincible}")
-                # print(f"Vehicle Is Destroyed: {vehicle.is_destroyed}")
-                # print(f"Vehicle Speed Limit: {vehicle.get_speed_limit()}")
-                # print("-" * 80)
-
-                logging.debug(f"Vehicle_ID: {vehicle.id}")
-                logging.debug(f"Vehicle_Type: {vehicle.type_id}")
-                logging.debug(f"Vehicle_Location: {vehicle.get_location()}")
-                logging.debug(f"Vehicle_Velocity: {vehicle.get_velocity()}")
-                logging.debug(f"Vehicle_Acceleration: {vehicle.get_acceleration()}")
-                logging.debug(f"Vehicle_Angular_Velocity: {vehicle.get_angular_velocity()}")
-                logging.debug(f"Vehicle_Attributes: {vehicle.attributes}")
-
-                logging.debug(f"traffic_light: {vehicle.get_traffic_light()}")
-                logging.debug(f"traffic_light_state: {vehicle.get_traffic_light_state()}")
-                logging.debug(f"transform: {vehicle.get_transform()}")
-                # logging.debug(f"wheel_steer_angle: {vehicle.get_wheel_steer_angle()}")
-                # 是否受到路灯影响
-                logging.debug(f"vehicle_is_at_traffic_light: {vehicle.is_at_traffic_light()}")
-                logging.debug(f"Vehicle_Velocity_value: {vehicle.get_velocity().length()}")
-                # 获取车辆控制信息
-                vehicle_control = vehicle.get_control()
-                # 获取方向盘的偏转角度
-                steering_angle = vehicle_control.steer
-                logging.debug(f"Vehicle_steering_angle: {steering_angle}")
-
-                # 移除不存在的属性调用
-                # print(f"Vehicle Is Invincible: {vehicle.is_invincible}")
-                # print(f"Vehicle Is Destroyed: {vehicle.is_destroyed}")
-                logging.debug(f"Vehicle_Speed_Limit: {vehicle.get_speed_limit()}")
-
-                logging.debug("-" * 40)
-                for key, value in inspect.getmembers(vehicle):
-                    if not key.startswith('__'):
-                        logging.debug(f"{key}: {value}")
-
-                # 使用 "-" * 60 分隔每一辆车的信息
-                logging.debug("-" * 60)
-
-            # 使用 "*" * 70 分隔车辆信息与信号灯信息
-            logging.debug("*" * 70)
-
-            # 循环输出交通信号灯信息
-            for tls in traffic_lights:
-                logging.debug(f"Location: {tls.get_location()}")
-                for key, value in inspect.getmembers(tls):
-                    if not key.startswith('__'):
-                        logging.debug(f"{key}: {value}")
-                # 使用 "+" * 40 分隔每一个信号灯信息
-                logging.debug("+" * 40)
-
-            # 使用 "+" * 70 分隔信号灯信息
-
-            # 使用 "*" * 80 分隔每一帧
-            logging.debug("*" * 80)
-
-            sleep_time = start_time + step_time + pt - time.time()
-            print(f"sleep_time: {sleep_time}")
-            # 等待0.5秒
-            time.sleep(sleep_time)
+            if recorder is not None:
+                recorder.write_frame(pt, vehicles, traffic_lights, traffic_signs, pedestrians, map_instance,
+                                     snapshot)
+            else:
+                log_frame(pt, vehicles, traffic_lights, traffic_signs, pedestrians, map_instance)
+                print(format_log_stats(log_handler))
 
     finally:
+        if scheduler is not None:
+            print(format_tick_stats(scheduler))
+        if recorder is not None:
+            recorder.close()
+        if log_handler is not None:
+            # 等待队列中的日志全部写完
+            log_handler.close()
+            print(format_log_stats(log_handler))
         print('Done.')
 
 
 if __name__ == '__main__':
-    main()
+    argparser = argparse.ArgumentParser(description='采集CARLA场景数据')
+    argparser.add_argument('--binary', action='store_true',
+                           help=f'写二进制状态记录 {RECORD_FILE_PATH}（state_recorder.py），不输出文本日志')
+    argparser.add_argument('--tick-mode', default='wall', choices=TICK_MODES,
+                           help='wall: 按墙钟时间采样；sync: 同步模式由 world.tick() 推进仿真；on_tick: 按仿真帧回调采样')
+    argparser.add_argument('--policy', default='skip', choices=OVERRUN_POLICIES,
+                           help='wall 模式下一帧处理超时后跳过错过的时间点（skip）或连续补采（catch_up）')
+    args = argparser.parse_args()
+    # 日志格式只用到时间、级别和消息，不需要调用位置、线程和进程信息，减少采集线程中创建日志记录的开销
+    # 这些是 logging 模块的全局设置，只在采集脚本直接运行时修改
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    main(args.binary, args.tick_mode, args.policy)
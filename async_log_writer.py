@@ -0,0 +1,134 @@
+import logging
+import queue
+import threading
+import time
+
+# 采集循环中的 logging.debug 只把记录放入有界队列，由后台线程格式化并批量写入文件
+# 磁盘慢时不会拖慢采集循环；队列满时按 overflow 策略阻塞或丢弃，并记录次数
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class AsyncLogHandler(logging.Handler):
+    def __init__(self, filename, maxsize=200000, overflow='block', batch_size=4096, encoding='utf-8'):
+        # overflow='block' 时队列满了等待写入线程（不丢日志，帧分隔符不会丢失）
+        # overflow='drop' 时直接丢弃该条记录，采集循环永不等待
+        if overflow not in ('block', 'drop'):
+            raise ValueError(f"overflow 只能是 'block' 或 'drop': {overflow}")
+        super().__init__()
+        self.queue = queue.Queue(maxsize)
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.file = open(filename, 'a', encoding=encoding)
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.max_depth = 0
+        self.write_errors = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.write_loop, name='async-log-writer', daemon=True)
+        self.thread.start()
+
+    def emit(self, record):
+        # 在采集线程中执行：不做格式化，只入队
+        # 调用方使用 logging.debug("%s: %s", key, value) 时，消息字符串（record.getMessage()）也在写入线程中生成
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow == 'drop':
+                self.dropped += 1
+                return
+            self.blocked += 1
+            start_time = time.perf_counter()
+            queued = self.put_blocking(record)
+            self.blocked_seconds += time.perf_counter() - start_time
+            if not queued:
+                self.dropped += 1
+                return
+        self.queued += 1
+
+    def put_blocking(self, item):
+        # 等待队列有空位；写入线程已经退出时不再等待（没有人会取走队列中的记录），返回 False
+        while self.thread.is_alive():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def write_loop(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # 队列深度在写入线程中统计，采集线程入队时不需要额外加锁
+            depth = len(batch) + self.queue.qsize()
+            if depth > self.max_depth:
+                self.max_depth = depth
+            lines = []
+            for record in batch:
+                if record is None:
+                    running = False
+                    continue
+                try:
+                    lines.append(self.format(record) + '\n')
+                except Exception:
+                    self.handleError(record)
+            if not lines:
+                continue
+            try:
+                self.file.write(''.join(lines))
+                self.file.flush()
+                self.written += len(lines)
+            except Exception:
+                # 磁盘写满、IO错误等：这一批记录丢失并计数，写入线程继续取出队列中的记录，采集循环不会被阻塞
+                self.write_errors += len(lines)
+                self.handleError(next(record for record in batch if record is not None))
+
+    def stats(self):
+        return {
+            'depth': self.queue.qsize(),
+            'max_depth': self.max_depth,
+            'queued': self.queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'blocked': self.blocked,
+            'blocked_seconds': self.blocked_seconds,
+            'write_errors': self.write_errors,
+        }
+
+    def close(self):
+        # 写完队列中剩余的记录后关闭文件，logging.shutdown 退出时也会调用
+        self.acquire()
+        try:
+            if not self.closed:
+                self.closed = True
+                if self.put_blocking(None):
+                    self.thread.join()
+                self.file.close()
+        finally:
+            self.release()
+        super().close()
+
+
+def start_async_logging(filename, level=logging.DEBUG, **kwargs):
+    # 代替 logging.basicConfig(filename=...)：根 logger 的输出交给 AsyncLogHandler
+    handler = AsyncLogHandler(filename, **kwargs)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    return handler
+
+
+def format_log_stats(handler):
+    stats = handler.stats()
+    return (f"log queue depth: {stats['depth']} (max {stats['max_depth']}), written: {stats['written']}, "
+            f"dropped: {stats['dropped']}, blocked: {stats['blocked']} ({stats['blocked_seconds']:.3f}s), "
+            f"write errors: {stats['write_errors']}")
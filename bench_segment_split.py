@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+import segment_split_plus as ssp
+from gen_capture_log import generate_capture_log
+
+# segment_split_plus.py 的性能测试：用模拟日志在不同规模下计时，结果写入json文件方便对比
+SCALES = {
+    'small': {'frames': 100, 'vehicles': 20, 'pedestrians': 10, 'traffic_lights': 20, 'traffic_signs': 5,
+              'crosswalks': 50, 'junctions': 10, 'map_size': 100.0},
+    'medium': {'frames': 500, 'vehicles': 80, 'pedestrians': 40, 'traffic_lights': 40, 'traffic_signs': 20,
+               'crosswalks': 200, 'junctions': 30, 'map_size': 200.0},
+    'large': {'frames': 1000, 'vehicles': 200, 'pedestrians': 80, 'traffic_lights': 80, 'traffic_signs': 40,
+              'crosswalks': 1000, 'junctions': 80, 'map_size': 400.0},
+}
+
+
+def time_call(func, repeat):
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start_time)
+    return result, seconds
+
+
+def bench_scale(scale_name, params, repeat, work_dir):
+    log_path = os.path.join(work_dir, f'bench_{scale_name}.log')
+    generate_capture_log(log_path, **params)
+    results = []
+
+    def record(stage, func):
+        result, seconds = time_call(func, repeat)
+        results.append({
+            'scale': scale_name,
+            'stage': stage,
+            'min': min(seconds),
+            'median': statistics.median(seconds),
+            'repeat': repeat,
+        })
+        print(f"{scale_name:<8} {stage:<40} min: {min(seconds):9.4f}s  median: {statistics.median(seconds):9.4f}s")
+        return result
+
+    record('build_frame_obj_list', lambda: ssp.build_frame_obj_list(log_path))
+
+    def parse_store(projection):
+        map_obj, frame_iter = ssp.open_log_stream(log_path, projection=projection)
+        return map_obj, ssp.build_frame_store(frame_iter)
+
+    record('build_frame_store(all fields)', lambda: parse_store(None))
+    map_obj, frame_store = record('build_frame_store', lambda: parse_store(ssp.FRAME_STORE_FIELDS))
+    # 不写全局词表文件，使用这份日志自己的词表
+    obs_type_vocab = {type_id: column for column, type_id in enumerate(frame_store['type_ids'])}
+
+    def fresh_map():
+        # 去掉缓存的空间索引，让每次计时都包含建索引的时间
+        return {key: value for key, value in map_obj.items() if key != 'spatial_index'}
+
+    scene_vec = record('create_scene_vecs', lambda: ssp.create_scene_vecs(frame_store, fresh_map()))
+    record('create_actor_vecs', lambda: ssp.create_actor_vecs(frame_store, fresh_map()))
+    radii = [5.0, 10.0, 20.0, 50.0]
+    record('create_actor_vecs_multi(4 radii)', lambda: ssp.create_actor_vecs_multi(frame_store, map_obj, radii))
+    record('create_obs_action_vecs_multi(4 radii)',
+           lambda: ssp.create_obs_action_vecs_multi(frame_store, map_obj, radii, obs_type_vocab=obs_type_vocab))
+    record('create_ego_action_vec', lambda: ssp.create_ego_action_vec(frame_store, map_obj))
+    obs_action_vec = record('create_obs_action_vec',
+                            lambda: ssp.create_obs_action_vec(frame_store, map_obj, obs_type_vocab=obs_type_vocab))
+    for window_size in [3, 15, 31]:
+        record(f'vec_denoise_v3(scene, w={window_size})', lambda: ssp.vec_denoise_v3(scene_vec, window_size))
+    record('vec_denoise_v3(obs, w=3)', lambda: ssp.vec_denoise_v3(obs_action_vec, 3))
+
+    info = dict(params, log_bytes=os.path.getsize(log_path))
+    os.remove(log_path)
+    return info, results
+
+
+def compare_results(results, baseline_path, threshold):
+    # 与之前的结果文件对比，median 变慢超过 threshold 的阶段视为回归
+    with open(baseline_path, 'r', encoding='utf-8') as file:
+        baseline = {(item['scale'], item['stage']): item for item in json.load(file)['results']}
+    regressions = []
+    for item in results:
+        old = baseline.get((item['scale'], item['stage']))
+        if old and old['median'] > 0 and item['median'] > old['median'] * (1 + threshold):
+            regressions.append((item['scale'], item['stage'], old['median'], item['median']))
+    for scale_name, stage, old_median, new_median in regressions:
+        print(f"regression: {scale_name} {stage} {old_median:.4f}s -> {new_median:.4f}s")
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='segment_split_plus.py 性能测试')
+    argparser.add_argument('--scales', default='small,medium', help=f"逗号分隔，可选: {','.join(SCALES)}")
+    argparser.add_argument('--repeat', default=3, type=int)
+    argparser.add_argument('--output', default='bench_results.json')
+    argparser.add_argument('--baseline', default=None, help='之前的结果文件，用于检查性能回归')
+    argparser.add_argument('--threshold', default=0.2, type=float, help='median 变慢超过该比例时报告回归')
+    args = argparser.parse_args()
+
+    scales = {}
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale_name in args.scales.split(','):
+            info, scale_results = bench_scale(scale_name, SCALES[scale_name], args.repeat, work_dir)
+            scales[scale_name] = info
+            results += scale_results
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'scales': scales,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"results saved to {args.output}")
+
+    if args.baseline:
+        if compare_results(results, args.baseline, args.threshold):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+import argparse
+import datetime
+import hashlib
+import math
+import random
+
+import numpy as np
+
+from map_geometry_cache import map_cache_path, save_map_geometry
+
+# 生成与 66_print_carla_test.py 格式一致的模拟采集日志，不需要启动CARLA
+# 用于 segment_split_plus.py 的性能测试
+
+VEHICLE_TYPES = ['vehicle.tesla.model3', 'vehicle.audi.tt', 'vehicle.lincoln.mkz_2020',
+                 'vehicle.nissan.patrol', 'vehicle.carlamotors.carlacola', 'vehicle.bh.crossbike']
+TRAFFIC_SIGN_TYPES = ['traffic.stop', 'traffic.yield', 'traffic.speed_limit.30', 'traffic.speed_limit.60']
+TRAFFIC_LIGHT_STATES = ['Red', 'Yellow', 'Green']
+
+VEHICLE_MEMBERS = ['add_angular_impulse', 'add_force', 'add_impulse', 'add_torque', 'apply_control',
+                   'apply_physics_control', 'destroy', 'get_acceleration', 'get_angular_velocity', 'get_control',
+                   'get_location', 'get_physics_control', 'get_speed_limit', 'get_traffic_light',
+                   'get_traffic_light_state', 'get_transform', 'get_velocity', 'is_at_traffic_light',
+                   'set_autopilot', 'set_location', 'set_simulate_physics', 'set_target_velocity', 'set_transform']
+ACTOR_MEMBERS = ['add_impulse', 'destroy', 'get_acceleration', 'get_location', 'get_transform', 'get_velocity',
+                 'set_location', 'set_transform']
+
+
+class CaptureLogWriter:
+    def __init__(self, file, start_time):
+        self.file = file
+        self.time = start_time
+        self.buffer = []
+
+    def debug(self, msg):
+        # 与 logging 的 '%(asctime)s - %(levelname)s - %(message)s' 格式一致
+        self.time += datetime.timedelta(microseconds=137)
+        asctime = self.time.strftime('%Y-%m-%d %H:%M:%S') + ',%03d' % (self.time.microsecond // 1000)
+        self.buffer.append(f"{asctime} - DEBUG - {msg}\n")
+        if len(self.buffer) >= 4096:
+            self.flush()
+
+    def flush(self):
+        self.file.write(''.join(self.buffer))
+        self.buffer = []
+
+
+def fmt_location(x, y, z):
+    return f"Location(x={x:.6f}, y={y:.6f}, z={z:.6f})"
+
+
+def fmt_vector3d(x, y, z):
+    return f"Vector3D(x={x:.6f}, y={y:.6f}, z={z:.6f})"
+
+
+def fmt_transform(x, y, z, yaw):
+    return f"Transform({fmt_location(x, y, z)}, Rotation(pitch=0.000000, yaw={yaw:.6f}, roll=0.000000))"
+
+
+def log_members(log, members, repr_name, values):
+    # 模拟 inspect.getmembers 的输出：按名字排序，方法输出 bound method
+    for key in sorted(set(members) | set(values)):
+        if key in values:
+            log.debug(f"{key}: {values[key]}")
+        else:
+            log.debug(f"{key}: <bound method {key} of {repr_name}>")
+
+
+def log_map(log, rnd, crosswalks, junctions, map_size, traffic_light_states, map_cache_dir=None):
+    # map_cache_dir 不为 None 时模拟新的采集脚本：几何信息写入地图缓存文件，日志中只记录缓存路径
+    crosswalk_points = []
+    for _ in range(crosswalks):
+        # 每个人行横道是一个闭合的四边形，共5个顶点
+        cx, cy = rnd.uniform(-map_size, map_size), rnd.uniform(-map_size, map_size)
+        corners = [(-4, -2), (4, -2), (4, 2), (-4, 2), (-4, -2)]
+        crosswalk_points += [(cx + dx, cy + dy) for dx, dy in corners]
+    junction_waypoints = []
+    for junction_id in range(junctions):
+        x, y = rnd.uniform(-map_size, map_size), rnd.uniform(-map_size, map_size)
+        junction_waypoints.append((x, y, rnd.getrandbits(48), rnd.uniform(-180, 180)))
+
+    log.debug('这是一条debug日志')
+    if map_cache_dir is not None:
+        map_name = 'Carla/Maps/Town10HD_Opt'
+        map_version = hashlib.sha1(repr((crosswalk_points, junction_waypoints,
+                                         traffic_light_states)).encode()).hexdigest()
+        path = map_cache_path(map_name, map_version, map_cache_dir)
+        # 与从日志解析得到的坐标一致，保留6位小数
+        save_map_geometry(path, map_name, map_version, {
+            'crosswalks': np.round([(x, y, 0.0) for x, y in crosswalk_points], 6).reshape(-1, 3),
+            'junctions': np.round([(x, y, 0.0) for x, y, _, _ in junction_waypoints], 6).reshape(-1, 3),
+            'junction_ids': np.array([waypoint_id for _, _, waypoint_id, _ in junction_waypoints], dtype=np.uint64),
+            'traffic_lights': np.round([(light['x'], light['y'], 0.0) for light in traffic_light_states],
+                                       6).reshape(-1, 3),
+            'traffic_light_ids': np.array([light['id'] for light in traffic_light_states], dtype=np.int64),
+        })
+        log.debug(f"name: {map_name}")
+        log.debug(f"map_geometry_cache: {path}")
+        log.debug("+" * 70)
+        log.debug("+" * 70)
+        log.debug("*" * 90)
+        return
+
+    log_members(log, ['cook_in_memory_map', 'generate_waypoints', 'get_crosswalks', 'get_spawn_points',
+                      'get_topology', 'get_waypoint', 'save_to_disk', 'transform_to_geolocation'],
+                'Map(name=Town10HD_Opt)',
+                {'name': 'Carla/Maps/Town10HD_Opt',
+                 'opendrive': '<?xml version="1.0" standalone="yes"?>\n<OpenDRIVE>\n</OpenDRIVE>'})
+    log.debug(f"map_crosswalks_length: {crosswalks * 5}")
+    log.debug("+" * 70)
+    for x, y in crosswalk_points:
+        log_members(log, ['distance', 'distance_2d', 'length', 'make_unit_vector', 'squared_length'],
+                    'Location', {'x': f"{x:.6f}", 'y': f"{y:.6f}", 'z': '0.000000'})
+        log.debug("+" * 60)
+    log.debug("+" * 70)
+    for junction_id, (x, y, waypoint_id, yaw) in enumerate(junction_waypoints):
+        log_members(log, ['get_junction', 'get_landmarks', 'get_left_lane', 'get_right_lane', 'next', 'previous'],
+                    'Waypoint',
+                    {'id': str(waypoint_id), 'is_junction': 'True', 'junction_id': str(junction_id),
+                     'lane_id': '-1', 'lane_width': '3.500000', 'road_id': str(junction_id),
+                     'transform': fmt_transform(x, y, 0.0, yaw)})
+        log.debug("+" * 60)
+    log.debug("*" * 90)
+
+
+def generate_capture_log(file_path, frames=100, vehicles=50, pedestrians=20, traffic_lights=30, traffic_signs=10,
+                         crosswalks=50, junctions=20, map_size=200.0, seed=0, map_cache_dir=None):
+    rnd = random.Random(seed)
+    step_time = 0.5
+    # 所有actor在同一个区域内随机游走，ego为第一辆车
+    vehicle_states = [{
+        'id': 100 + i,
+        'type_id': rnd.choice(VEHICLE_TYPES[:-1]) if i == 0 else rnd.choice(VEHICLE_TYPES),
+        'x': rnd.uniform(-map_size, map_size),
+        'y': rnd.uniform(-map_size, map_size),
+        'yaw': rnd.uniform(-180, 180),
+        'speed': rnd.uniform(0, 10),
+    } for i in range(vehicles + 1)]
+    pedestrian_states = [{
+        'id': 5000 + i,
+        'type_id': 'walker.pedestrian.%04d' % rnd.randint(1, 49),
+        'x': rnd.uniform(-map_size, map_size),
+        'y': rnd.uniform(-map_size, map_size),
+    } for i in range(pedestrians)]
+    traffic_light_states = [{
+        'id': 2000 + i,
+        'x': rnd.uniform(-map_size, map_size),
+        'y': rnd.uniform(-map_size, map_size),
+        'state': rnd.choice(TRAFFIC_LIGHT_STATES),
+    } for i in range(traffic_lights)]
+    traffic_sign_states = [{
+        'id': 3000 + i,
+        'type_id': rnd.choice(TRAFFIC_SIGN_TYPES),
+        'x': rnd.uniform(-map_size, map_size),
+        'y': rnd.uniform(-map_size, map_size),
+    } for i in range(traffic_signs)]
+
+    with open(file_path, 'w', encoding='utf-8') as file:
+        log = CaptureLogWriter(file, datetime.datetime(2024, 6, 9, 10, 0, 0))
+        log_map(log, rnd, crosswalks, junctions, map_size, traffic_light_states, map_cache_dir)
+
+        for frame_number in range(frames):
+            pt = frame_number * step_time
+            log.debug(f"Time_info: {pt:.2f}s")
+            log.debug(f"Time: {pt:.2f}")
+            log.debug("*" * 70)
+
+            for vehicle in vehicle_states:
+                steer = rnd.choice([0.0, 0.0, rnd.uniform(-0.3, 0.3)])
+                vehicle['yaw'] += steer * 20
+                vehicle['speed'] = max(0.0, vehicle['speed'] + rnd.uniform(-1, 1))
+                yaw = math.radians(vehicle['yaw'])
+                fx, fy = math.cos(yaw), math.sin(yaw)
+                vehicle['x'] += fx * vehicle['speed'] * step_time
+                vehicle['y'] += fy * vehicle['speed'] * step_time
+                vx, vy = fx * vehicle['speed'], fy * vehicle['speed']
+                role_name = 'hero' if vehicle is vehicle_states[0] else 'autopilot'
+                repr_name = f"Vehicle(id={vehicle['id']}, type={vehicle['type_id']})"
+                light_state = rnd.choice(TRAFFIC_LIGHT_STATES)
+
+                log.debug(f"Vehicle_ID: {vehicle['id']}")
+                log.debug(f"Vehicle_Type: {vehicle['type_id']}")
+                log.debug(f"Vehicle_Location: {fmt_location(vehicle['x'], vehicle['y'], 0.0)}")
+                log.debug(f"Vehicle_Velocity: {fmt_vector3d(vx, vy, 0.0)}")
+                log.debug(f"Vehicle_Acceleration: {fmt_vector3d(0.0, 0.0, 0.0)}")
+                log.debug(f"Vehicle_Angular_Velocity: {fmt_vector3d(0.0, 0.0, steer)}")
+                log.debug("traffic_light: None")
+                log.debug(f"traffic_light_state: {light_state}")
+                log.debug(f"transform: {fmt_transform(vehicle['x'], vehicle['y'], 0.0, vehicle['yaw'])}")
+                log.debug(f"forward_vector: {fmt_vector3d(fx, fy, 0.0)}")
+                log.debug("vehicle_is_at_traffic_light: False")
+                log.debug(f"Vehicle_Velocity_value: {vehicle['speed']}")
+                log.debug(f"Vehicle_steering_angle: {steer}")
+                log.debug("Vehicle_Speed_Limit: 30.0")
+                log.debug("-" * 40)
+                # attributes 中 role_name 放在最后，与解析逻辑保持一致
+                log_members(log, VEHICLE_MEMBERS, repr_name, {
+                    'attributes': f"{{'number_of_wheels': '4', 'sticky_control': 'True', 'role_name': '{role_name}'}}",
+                    'bounding_box': f"BoundingBox({fmt_location(0.0, 0.0, 0.7)}, Extent(x=2.4, y=1.0, z=0.7))",
+                    'id': str(vehicle['id']),
+                    'is_alive': 'True',
+                    'parent': 'None',
+                    'semantic_tags': '[10]',
+                    'type_id': vehicle['type_id'],
+                })
+                log.debug("-" * 60)
+            log.debug("*" * 70)
+
+            for traffic_light in traffic_light_states:
+                if rnd.random() < 0.05:
+                    traffic_light['state'] = rnd.choice(TRAFFIC_LIGHT_STATES)
+                log.debug(f"Location: {fmt_location(traffic_light['x'], traffic_light['y'], 0.0)}")
+                log_members(log, ACTOR_MEMBERS + ['freeze', 'get_state', 'set_state'],
+                            f"TrafficLight(id={traffic_light['id']}, type=traffic.traffic_light)", {
+                                'attributes': '{}',
+                                'id': str(traffic_light['id']),
+                                'is_alive': 'True',
+                                'state': traffic_light['state'],
+                                'type_id': 'traffic.traffic_light',
+                            })
+                log.debug("+" * 40)
+            log.debug("*" * 70)
+
+            for traffic_sign in traffic_sign_states:
+                log.debug(f"Location: {fmt_location(traffic_sign['x'], traffic_sign['y'], 0.0)}")
+                log_members(log, ACTOR_MEMBERS,
+                            f"TrafficSign(id={traffic_sign['id']}, type={traffic_sign['type_id']})", {
+                                'attributes': '{}',
+                                'id': str(traffic_sign['id']),
+                                'is_alive': 'True',
+                                'type_id': traffic_sign['type_id'],
+                            })
+                log.debug("+" * 50)
+            log.debug("*" * 70)
+
+            for pedestrian in pedestrian_states:
+                pedestrian['x'] += rnd.uniform(-0.7, 0.7)
+                pedestrian['y'] += rnd.uniform(-0.7, 0.7)
+                log.debug(f"Location: {fmt_location(pedestrian['x'], pedestrian['y'], 0.0)}")
+                log.debug(f"is_walker_on_road: {rnd.random() < 0.3}")
+                log_members(log, ACTOR_MEMBERS + ['apply_control'],
+                            f"Walker(id={pedestrian['id']}, type={pedestrian['type_id']})", {
+                                'attributes': "{'age': 'adult', 'is_invincible': 'false', 'speed': '1.4'}",
+                                'id': str(pedestrian['id']),
+                                'is_alive': 'True',
+                                'type_id': pedestrian['type_id'],
+                            })
+                log.debug("+" * 40)
+            log.debug("*" * 80)
+        log.flush()
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='生成模拟的CARLA采集日志')
+    argparser.add_argument('output', help='输出的日志文件路径')
+    argparser.add_argument('--frames', default=100, type=int)
+    argparser.add_argument('--vehicles', default=50, type=int, help='背景车数量（不含ego）')
+    argparser.add_argument('--pedestrians', default=20, type=int)
+    argparser.add_argument('--traffic-lights', default=30, type=int)
+    argparser.add_argument('--traffic-signs', default=10, type=int)
+    argparser.add_argument('--crosswalks', default=50, type=int)
+    argparser.add_argument('--junctions', default=20, type=int)
+    argparser.add_argument('--map-size', default=200.0, type=float, help='actor分布范围 [-map_size, map_size]')
+    argparser.add_argument('--seed', default=0, type=int)
+    argparser.add_argument('--map-cache-dir', default=None,
+                           help='指定时地图几何信息写入该目录下的缓存文件，日志中只记录缓存路径')
+    args = argparser.parse_args()
+    generate_capture_log(args.output, args.frames, args.vehicles, args.pedestrians, args.traffic_lights,
+                         args.traffic_signs, args.crosswalks, args.junctions, args.map_size, args.seed,
+                         args.map_cache_dir)
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import re
+
+import numpy as np
+
+# 地图静态几何信息（人行横道顶点、交叉路口、信号灯位置）的二进制缓存
+# 采集脚本每张地图只计算一次，segment_split_plus.py 直接读取同一个文件，不再从每个日志中解析
+MAP_CACHE_DIR = os.path.join('data', 'map_cache')
+# 修改缓存内容的结构后需要增加 MAP_CACHE_VERSION
+MAP_CACHE_VERSION = 1
+MAP_GEOMETRY_KEYS = ['crosswalks', 'junctions', 'junction_ids', 'traffic_lights', 'traffic_light_ids']
+
+
+def map_cache_path(map_name, map_version, cache_dir=MAP_CACHE_DIR):
+    # 文件名由地图名和地图版本（opendrive 内容的哈希）组成，地图更新后自动使用新的缓存
+    safe_name = re.sub(r'[^\w.-]+', '_', map_name).strip('_')
+    return os.path.join(cache_dir, f"{safe_name}.v{MAP_CACHE_VERSION}.{map_version[:16]}.npz")
+
+
+def save_map_geometry(path, map_name, map_version, geometry):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, map_name=map_name, map_version=map_version, cache_version=MAP_CACHE_VERSION,
+             **{key: geometry[key] for key in MAP_GEOMETRY_KEYS})
+    os.replace(tmp_path, path)
+
+
+def load_map_geometry(path):
+    # 文件不存在或版本不一致时返回 None
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if int(data['cache_version']) != MAP_CACHE_VERSION:
+            return None
+        geometry = {key: data[key] for key in MAP_GEOMETRY_KEYS}
+        geometry['map_name'] = str(data['map_name'])
+        geometry['map_version'] = str(data['map_version'])
+    return geometry
+
+
+def find_map_geometry(path, cache_dir=MAP_CACHE_DIR):
+    # 日志中记录的是采集机器上的路径，找不到时再到本地的缓存目录中按文件名查找
+    for candidate in [path, os.path.join(cache_dir, os.path.basename(path))]:
+        geometry = load_map_geometry(candidate)
+        if geometry is not None:
+            return geometry
+    raise FileNotFoundError(f"地图几何缓存不存在: {path}")
+
+
+def get_map_version(map_instance):
+    return hashlib.sha1(map_instance.to_opendrive().encode('utf-8')).hexdigest()
+
+
+def collect_map_geometry(world, map_instance):
+    # 需要连接CARLA：人行横道顶点、拓扑中连接数大于2的 waypoint（交叉路口）、所有信号灯的位置
+    crosswalks = [(location.x, location.y, location.z) for location in map_instance.get_crosswalks()]
+
+    # 统计每个Waypoint的连接数
+    waypoint_connections = {}
+    for waypoint_pair in map_instance.get_topology():
+        for waypoint in waypoint_pair:
+            waypoint_connections[waypoint] = waypoint_connections.get(waypoint, 0) + 1
+    intersections = [wp for wp, count in waypoint_connections.items() if count > 2]
+    junctions = [(wp.transform.location.x, wp.transform.location.y, wp.transform.location.z)
+                 for wp in intersections]
+
+    traffic_lights = list(world.get_actors().filter('traffic.traffic_light'))
+    traffic_light_locations = []
+    for traffic_light in traffic_lights:
+        location = traffic_light.get_location()
+        traffic_light_locations.append((location.x, location.y, location.z))
+
+    return {
+        'crosswalks': np.array(crosswalks, dtype=np.float64).reshape(-1, 3),
+        'junctions': np.array(junctions, dtype=np.float64).reshape(-1, 3),
+        'junction_ids': np.array([wp.id for wp in intersections], dtype=np.uint64),
+        'traffic_lights': np.array(traffic_light_locations, dtype=np.float64).reshape(-1, 3),
+        'traffic_light_ids': np.array([traffic_light.id for traffic_light in traffic_lights], dtype=np.int64),
+    }
+
+
+def ensure_map_geometry_cache(world, map_instance, cache_dir=MAP_CACHE_DIR):
+    # 采集开始时调用：缓存已存在时直接返回路径，否则计算一次并保存
+    map_version = get_map_version(map_instance)
+    path = map_cache_path(map_instance.name, map_version, cache_dir)
+    if load_map_geometry(path) is None:
+        save_map_geometry(path, map_instance.name, map_version, collect_map_geometry(world, map_instance))
+    return os.path.abspath(path)
@@ -1,74 +1,134 @@
-import math
+import argparse
+import glob
+import hashlib
+import heapq
+import json
+import mmap
 import os
+import pickle
 import re
+import sys
+import time
+import traceback
+import tracemalloc
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+
 import numpy as np
 
-def loadlog():
-    log_data = None
-    # 检查'data'文件夹是否存在
-    if not os.path.exists('data'):
-        print("文件夹 'data' 不存在。")
-    else:
-        # 'data'文件夹存在，检查'myapp1.log'文件是否存在
-        file_path = os.path.join('data', 'myapp6.1.log')
-        if not os.path.exists(file_path):
-            print("日志文件不存在。")
-        else:
-            # 'myapp1.log'文件存在，尝试读取文件内容
-            try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    log_data = file.read()
-                    # 这里可以添加处理日志数据的代码
-                    print('ready!')
-            except UnicodeDecodeError:
-                # 如果UTF-8编码失败，尝试使用GBK编码
-                with open(file_path, 'r', encoding='gbk') as file:
-                    log_data = file.read()
-                    # 这里可以添加处理日志数据的代码
-                    print('ready!')
-    # print(log_data)
-    return log_data
-
-
-def calc_ego_distance(frame_obj):
-    vehicle_obj_list = frame_obj['vehicle_obj_list']
-    ego_obj_list = frame_obj['ego_obj_list']
-    traffic_light_obj_list = frame_obj['traffic_light_obj_list']
-    traffic_sign_obj_list = frame_obj['traffic_sign_obj_list']
-
-    ego_obj = ego_obj_list[0]
-    ego_loc = ego_obj.get('location3d')
-
-    ego_x = ego_loc.get('x')
-    ego_y = ego_loc.get('y')
-
-    for vehicle_obj in vehicle_obj_list:
-        vehicle_loc = vehicle_obj.get('location3d')
-        if vehicle_loc:
-            ego_distance = math.sqrt((vehicle_loc.get('x') - ego_x)**2 + (vehicle_loc.get('y') - ego_y)**2)
-            vehicle_obj['ego_distance'] = ego_distance
-
-    for traffic_light_obj in traffic_light_obj_list:
-        traffic_light_loc = traffic_light_obj.get('location3d')
-        if traffic_light_loc:
-            ego_distance = math.sqrt((traffic_light_loc.get('x') - ego_x)**2 + (traffic_light_loc.get('y') - ego_y)**2)
-            traffic_light_obj['ego_distance'] = ego_distance
-
-    for traffic_sign_obj in traffic_sign_obj_list:
-        traffic_sign_loc = traffic_sign_obj.get('location3d')
-        if traffic_sign_loc:
-            ego_distance = math.sqrt((traffic_sign_loc.get('x') - ego_x) ** 2 + (traffic_sign_loc.get('y') - ego_y) ** 2)
-            traffic_sign_obj['ego_distance'] = ego_distance
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，用 msvcrt.locking 代替
+    fcntl = None
+    import msvcrt
+
+from map_geometry_cache import find_map_geometry
+from state_recorder import RECORD_CLASSES, RECORD_DTYPES, forward_vectors, is_state_record, open_state_record
+
+LOG_FILE_PATH = os.path.join('data', 'myapp6.1.log')
+# 全局 obs_type 词表，所有日志共用同一套列布局
+OBS_TYPE_VOCAB_PATH = os.path.join('data', 'obs_type_vocab.json')
+OBS_TYPE_VOCAB_CAPACITY = 128
+# obs_action_vec 默认统计的障碍物范围（米）
+OBS_NEAR_DISTANCE = 5.0
+# 解析结果缓存，修改解析逻辑或 frame_store 结构后需要增加 PARSER_VERSION
+PARSER_VERSION = 1
+PARSE_CACHE_DIR = os.path.join('data', 'parse_cache')
+PARSE_CACHE_MAX_BYTES = 4 * 1024 ** 3
+PARSE_CACHE_TMP_MAX_AGE = 3600
+# 帧索引中每一帧记录的 "*" * 70 分段数：时间、车辆、信号灯、交通标识、行人
+FRAME_INDEX_SECTIONS = 5
+# 分段编码使用的列：scene_vec、actor_vec、ego_action_vec 依次拼接，每列占一个二进制位
+SCENE_VEC_COLUMNS = ['red', 'yellow', 'green', 'off', 'unknown', 'signal_type', 'subsignal_type',
+                     'crosswalk', 'stop_sign', 'junction']
+ACTOR_VEC_COLUMNS = ['near_vehicle', 'near_bicycle', 'near_pedestrian', 'near_other', 'pedestrian_on_road',
+                     'pedestrian_on_crosswalk', 'opposing_vehicle', 'crossing_vehicle']
+EGO_ACTION_VEC_COLUMNS = ['turn_left', 'turn_right', 'forward', 'speed_equal', 'speed_up', 'speed_down']
+SEGMENT_COLUMNS = SCENE_VEC_COLUMNS + ACTOR_VEC_COLUMNS + EGO_ACTION_VEC_COLUMNS
+SEGMENT_INDEX_NAME = 'segment_index.npz'
+# 每个字节中1的个数，numpy 没有 bitwise_count 时用于计算汉明距离
+POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def calc_ego_distance(frame_store):
+    # 一次性计算所有帧、所有类型actor（含行人）与ego之间的二维距离
+    ego_locs = frame_store['ego']['location']
+    for actor_class in ACTOR_CLASSES:
+        if actor_class == 'ego':
+            continue
+        actors = frame_store[actor_class]
+        ego_loc = ego_locs[actors['frame']]
+        actor_loc = actors['location']
+        actors['ego_distance'] = np.sqrt((actor_loc[:, 0] - ego_loc[:, 0]) ** 2 +
+                                         (actor_loc[:, 1] - ego_loc[:, 1]) ** 2)
+
+
+class StreamingDenoiser:
+    # 滑动窗口多数投票：每行向量编码成整数，窗口移动时只更新移出和移入的两行的计数，
+    # 用堆找出票数最多的向量，票数相同时取窗口内最先出现的向量（与 get_majority 一致）
+    # 窗口满 window_size 行后，每输入一行输出一个结果，固定延迟 window_size 帧
+    def __init__(self, window_size=5):
+        if window_size <= 0:
+            raise ValueError("window_size 必须大于0")
+        self.window_size = window_size
+        self.codes = {}
+        self.window = deque()
+        self.window_start = 0
+        self.counts = {}
+        self.positions = {}
+        self.heap = []
+
+    def push_heap(self, code):
+        heapq.heappush(self.heap, (-self.counts[code], self.positions[code][0], code))
+
+    def majority(self):
+        # 丢弃过期的堆元素
+        while True:
+            neg_count, first_index, code = self.heap[0]
+            if self.counts.get(code) == -neg_count and self.positions[code][0] == first_index:
+                return self.window[first_index - self.window_start][0]
+            heapq.heappop(self.heap)
+
+    def push(self, vec):
+        outputs = []
+        if len(self.window) == self.window_size:
+            outputs.append(self.majority())
+            # 移出最早的一行
+            _, code = self.window.popleft()
+            self.window_start += 1
+            self.counts[code] -= 1
+            self.positions[code].popleft()
+            if self.counts[code]:
+                self.push_heap(code)
+            else:
+                del self.counts[code]
+                del self.positions[code]
+
+        code = self.codes.setdefault(tuple(vec), len(self.codes))
+        self.counts[code] = self.counts.get(code, 0) + 1
+        self.positions.setdefault(code, deque()).append(self.window_start + len(self.window))
+        self.window.append((vec, code))
+        self.push_heap(code)
+        if len(self.heap) > 4 * self.window_size + 64:
+            self.heap = [(-count, self.positions[code][0], code) for code, count in self.counts.items()]
+            heapq.heapify(self.heap)
+        return outputs
 
 
 def vec_denoise_v3(record_vec, window_size=5):
     new_record_vec = []
-    for i in range(len(record_vec) - window_size):
-        current_window = record_vec[i:i+window_size]
-        major_vec = get_majority(current_window)
-        # print(major_vec)
-        new_record_vec.append(major_vec)
-
+    window_count = len(record_vec) - window_size
+    if window_count <= 0:
+        return new_record_vec
+    if window_size <= 0:
+        return [get_majority(record_vec[i:i + window_size]) for i in range(window_count)]
+
+    denoiser = StreamingDenoiser(window_size)
+    for vec in record_vec:
+        new_record_vec += denoiser.push(vec)
     # new_record_vec = np.array(new_record_vec)
     return new_record_vec
 
@@ -101,11 +161,8 @@ def get_majority(vec_list):
 def dealLocation(obj, fieldname):
     location = obj.get(fieldname)  #  Location(x=32.367764, y=-81.074402, z=0.003042)
     if location:
-        # 定义匹配模式
-        pattern = r"Location\(x=(-?\d+\.\d+), y=(-?\d+\.\d+), z=(-?\d+\.\d+)\)"
-
-        # 使用正则表达式查找匹配项
-        match = re.match(pattern, location)
+        # 使用预编译的 LOCATION_PATTERN 查找匹配项
+        match = LOCATION_PATTERN.match(location)
 
         # 判断是否符合要求
         if match:
@@ -120,160 +177,328 @@ def dealLocation(obj, fieldname):
             }
 
 
-def deal_vector3d(obj, src_field_name, target_field_name):
-    location = obj.get(src_field_name)  # Vector3D(x=32.367764, y=-81.074402, z=0.003042)
-    if location:
-        # 定义匹配模式
-        pattern = r"Vector3D\(x=(-?\d+\.\d+), y=(-?\d+\.\d+), z=(-?\d+\.\d+)\)"
+def create_ego_action_vec(frame_store, map):
+    ego = frame_store['ego']
+    # turn left,turn right,forward
+    steering_angle = ego['steering_angle']
+    turn_left = steering_angle < 0
+    turn_right = steering_angle > 0
+    move_state = np.column_stack([turn_left, turn_right, ~(turn_left | turn_right)])
+    # speed    equal   speed up   speed down
+    velocity_value = ego['velocity_value']
+    speed_up = np.zeros(len(velocity_value), dtype=bool)
+    speed_down = np.zeros(len(velocity_value), dtype=bool)
+    speed_up[1:] = velocity_value[1:] > velocity_value[:-1]
+    speed_down[1:] = velocity_value[1:] < velocity_value[:-1]
+    speed_state = np.column_stack([~(speed_up | speed_down), speed_up, speed_down])
+
+    ego_actions = np.concatenate([move_state, speed_state], axis=1).astype(int)
+    return ego_actions.tolist()
 
-        # 使用正则表达式查找匹配项
-        match = re.match(pattern, location)
 
-        # 判断是否符合要求
-        if match:
-            # 如果匹配成功，提取并返回x, y, z的值
-            x = float(match.group(1))
-            y = float(match.group(2))
-            z = float(match.group(3))
-            obj[target_field_name] = {
-                'x': x,
-                'y': y,
-                'z': z
-            }
+def deal_floor_array(vals, floor_height=5):
+    return np.where(vals <= 0, 0, vals // floor_height + 1)
 
 
-def create_ego_action_vec(frame_obj_list, map):
-    move_state = []
-    speed_state = []
-    pre_speed_value = None
-    for frame_obj in frame_obj_list:
-        ego_obj = frame_obj.get('ego_obj_list')[0]
-        # turn left,turn right,forward
-        vehicle_steering_angle = ego_obj['vehicle_steering_angle']
-        vehicle_steering_angle = float(vehicle_steering_angle)
-        if vehicle_steering_angle < 0:
-            move_state.append([1, 0, 0])
-        elif vehicle_steering_angle > 0:
-            move_state.append([0, 1, 0])
-        else:
-            move_state.append([0, 0, 1])
-        # speed    equal   speed up   speed down
-        vehicle_velocity_value = ego_obj['vehicle_velocity_value']
-        vehicle_velocity_value = float(vehicle_velocity_value)
-        if pre_speed_value is None:
-            speed_state.append([1, 0, 0])
-        elif vehicle_velocity_value > pre_speed_value:
-            speed_state.append([0, 1, 0])
-        elif vehicle_velocity_value < pre_speed_value:
-            speed_state.append([0, 0, 1])
+def try_lock_file(fd):
+    # 非阻塞地加排它锁，锁由内核持有，进程退出（包括被 kill）时自动释放
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
         else:
-            speed_state.append([1, 0, 0])
-        pre_speed_value = vehicle_velocity_value
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
 
-    move_state = np.vstack(move_state)
-    speed_state = np.vstack(speed_state)
-    ego_actions = np.concatenate([move_state, speed_state], axis=1)
-    return ego_actions.tolist()
+
+def unlock_file(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path, timeout=30.0):
+    # 对 .lock 文件加 flock 实现跨进程互斥；.lock 文件保留不删除，删除后其它进程可能锁住不同的文件
+    lock_path = path + '.lock'
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+    try:
+        deadline = time.time() + timeout
+        while not try_lock_file(fd):
+            if time.time() > deadline:
+                raise TimeoutError(f"获取文件锁超时: {lock_path}")
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            unlock_file(fd)
+    finally:
+        os.close(fd)
+
+
+# 词表已满、没有写入词表的 type_id，同一进程中不再重复加锁尝试写入
+obs_type_overflow = set()
+
+
+def load_obs_type_vocab(path=OBS_TYPE_VOCAB_PATH):
+    # 返回 {type_id: column}，文件中按列号顺序保存 type_id 列表
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        type_ids = json.load(file)
+    return {type_id: column for column, type_id in enumerate(type_ids)}
+
+
+def update_obs_type_vocab(type_ids, path=OBS_TYPE_VOCAB_PATH):
+    # 只追加新的 type_id，已有 type_id 的列号永远不变
+    # 词表已满（OBS_TYPE_VOCAB_CAPACITY）时新的 type_id 不再写入文件，向量中计入最后一列，并给出警告
+    vocab = load_obs_type_vocab(path)
+    new_type_ids = {type_id for type_id in type_ids
+                    if type_id is not None and type_id not in vocab and type_id not in obs_type_overflow}
+    if not new_type_ids:
+        return vocab
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with file_lock(path):
+        # 加锁后重新读取，避免覆盖其它进程追加的类型
+        vocab = load_obs_type_vocab(path)
+        overflow = []
+        for type_id in sorted(new_type_ids):
+            if type_id in vocab:
+                continue
+            if len(vocab) < OBS_TYPE_VOCAB_CAPACITY:
+                vocab[type_id] = len(vocab)
+            else:
+                overflow.append(type_id)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(sorted(vocab, key=vocab.get), file, ensure_ascii=False, indent=0)
+        os.replace(tmp_path, path)
+    if overflow:
+        obs_type_overflow.update(overflow)
+        warnings.warn(f"obs_type 词表已满（{OBS_TYPE_VOCAB_CAPACITY} 种），以下类型计入最后一列: {', '.join(overflow)}")
+    return vocab
+
+
+def near_obstacles(frame_store, near_distances):
+    # 在 near_distances 中任一半径内的障碍物，返回 (帧号, type_code, 半径桶号)
+    radius_count = len(near_distances)
+    near_frames = []
+    near_types = []
+    near_buckets = []
+    for actor_class in ['vehicle', 'traffic_light', 'traffic_sign', 'pedestrian']:
+        actors = frame_store[actor_class]
+        ego_distance = actors['ego_distance']
+        buckets = radius_buckets(ego_distance, near_distances)
+        near = buckets < radius_count
+        if actor_class == 'vehicle':
+            # 与原逻辑一致，ego_distance 为0的车辆不计入
+            near &= ego_distance != 0
+        near_frames.append(actors['frame'][near])
+        near_types.append(actors['type_code'][near])
+        near_buckets.append(buckets[near])
+    return np.concatenate(near_frames).astype(np.int64), np.concatenate(near_types), np.concatenate(near_buckets)
+
+
+def type_ids_of(frame_store, type_codes):
+    return [frame_store['type_ids'][code] for code in np.unique(type_codes) if code >= 0]
+
+
+def near_type_ids(frame_store, near_distances):
+    # 实际出现在障碍物范围内的 type_id，只有这些类型需要写入 obs_type 词表
+    return type_ids_of(frame_store, near_obstacles(frame_store, near_distances)[1])
 
 
-def deal_floor(val, floor_height=5):
-    if val <= 0:
-        return 0
-    return int(val) // floor_height + 1
+def radius_buckets(distances, radii):
+    # 距离小于 radii[i] 的 actor 其桶号 <= i，不在任何半径内（或距离为nan）时桶号为 len(radii)
+    return np.searchsorted(np.sort(radii), distances, side='right')
+
+
+def count_frames_by_radius(frame_index, buckets, frame_count, radius_count):
+    # 返回 (frame_count, radius_count)，第 i 列为每帧在第 i 个（从小到大）半径内的数量
+    counts = np.bincount(frame_index * (radius_count + 1) + buckets,
+                         minlength=frame_count * (radius_count + 1)).reshape(frame_count, radius_count + 1)
+    return np.cumsum(counts[:, :radius_count], axis=1)
+
+
+def radius_columns(radii):
+    # radii 中每个半径在排序后的位置
+    return np.argsort(np.argsort(radii, kind='stable'), kind='stable')
 
 
 # 生成obs_action_vec
-def create_obs_action_vec(frame_obj_list, map, near_distance=5.0):
-    obs_type_list = []
-    obs_type_set = []
-    obs_type_num_list = []
-    for frame_obj in frame_obj_list:
-        vehicle_obj_list = frame_obj.get('vehicle_obj_list')
-        traffic_light_obj_list = frame_obj.get('traffic_light_obj_list')
-        traffic_sign_obj_list = frame_obj.get('traffic_sign_obj_list')
-        pedestrian_obj_list = frame_obj.get('pedestrian_obj_list')
-        obs_type = []
-        obs_type_num = {}
-
-        for vehicle_obj in vehicle_obj_list:
-            if vehicle_obj.get('ego_distance') is not None and vehicle_obj.get('ego_distance'):
-                ego_distance = float(vehicle_obj.get('ego_distance'))
-                if ego_distance < near_distance:
-                    type_id = vehicle_obj.get('vehicle_type')
-                    obs_type.append(type_id)
-                    if type_id not in obs_type_num:
-                        obs_type_num[type_id] = 0
-                    obs_type_num[type_id] = obs_type_num[type_id] + 1
-
-        for traffic_light_obj in traffic_light_obj_list:
-            if traffic_light_obj.get('ego_distance') is not None:
-                ego_distance = float(traffic_light_obj.get('ego_distance'))
-                if ego_distance < near_distance:
-                    obs_type.append(traffic_light_obj.get('type_id'))
-                    type_id = traffic_light_obj.get('type_id')
-                    if type_id not in obs_type_num:
-                        obs_type_num[type_id] = 0
-                    obs_type_num[type_id] = obs_type_num[type_id] + 1
-
-        for traffic_sign_obj in traffic_sign_obj_list:
-            if traffic_sign_obj.get('ego_distance') is not None:
-                ego_distance = float(traffic_sign_obj.get('ego_distance'))
-                if ego_distance < near_distance:
-                    obs_type.append(traffic_sign_obj.get("type_id"))
-                    type_id = traffic_sign_obj.get('type_id')
-                    if type_id not in obs_type_num:
-                        obs_type_num[type_id] = 0
-                    obs_type_num[type_id] = obs_type_num[type_id] + 1
-
-        for pedestrian_obj in  pedestrian_obj_list:
-            if pedestrian_obj.get("ego_distance") is not None:
-                ego_distance = float(pedestrian_obj.get("ego_distance"))
-                if ego_distance < near_distance:
-                    obs_type.append(pedestrian_obj.get("type_id"))
-                    type_id = pedestrian_obj.get('type_id')
-                    if type_id not in obs_type_num:
-                        obs_type_num[type_id] = 0
-                    obs_type_num[type_id] = obs_type_num[type_id] + 1
-        # 这一帧的 obs_type
-        obs_type_set += obs_type
-        obs_type = list(set(obs_type))
-        obs_type_list.append(obs_type)
-        obs_type_num_list.append(obs_type_num)
-
-    obs_type_set = list(set(obs_type_set))
-    obs_types_vec = []
-    obs_type_num_vec = []
-    for t, n in zip(obs_type_list, obs_type_num_list):
-        vec = [0 for _ in range(len(obs_type_set) + 1)]
-        for v in t:
-            vec[obs_type_set.index(v)] = 1
-        obs_types_vec.append(vec)
-
-        vec = [0 for _ in range(len(obs_type_set) + 1)]
-        for key, value in n.items():
-            val = int(value)
-            vec[obs_type_set.index(key)] = deal_floor(val)
-        obs_type_num_vec.append(vec)
-
-    obs_types_vec = np.vstack(obs_types_vec)
-    obs_type_num_vec = np.vstack(obs_type_num_vec)
-
-    obstacle_actions = np.concatenate([obs_types_vec, obs_type_num_vec], axis=1)
-    return obstacle_actions.tolist()
-
-
-
-def record2vec():
-    frame_obj_list, map_obj = build_frame_obj_list()
-    scene_vec = create_scene_vecs(frame_obj_list, map_obj)
-    actor_vec = create_actor_vecs(frame_obj_list, map_obj)
-    ego_action_vec = create_ego_action_vec(frame_obj_list, map)
-    obs_action_vec = create_obs_action_vec(frame_obj_list, map)
-
-    scene_vec = vec_denoise_v3(scene_vec, 3)
-    actor_vec = vec_denoise_v3(actor_vec, 3)
-    ego_action_vec = vec_denoise_v3(ego_action_vec, 3)
-    obs_action_vec = vec_denoise_v3(obs_action_vec, 3)
+# 列布局由持久化的 obs_type 词表决定，宽度固定为 2 * (OBS_TYPE_VOCAB_CAPACITY + 1)，
+# 最后一列记录词表容量之外（或没有 type_id）的障碍物
+def create_obs_action_vec(frame_store, map, near_distance=OBS_NEAR_DISTANCE, obs_type_vocab=None):
+    return create_obs_action_vecs_multi(frame_store, map, [near_distance], obs_type_vocab)[near_distance]
+
+
+def create_obs_action_vecs_multi(frame_store, map, near_distances, obs_type_vocab=None):
+    # 一次计算多个半径的 obs_action_vec，返回 {半径: 向量}
+    # 每个障碍物只按距离分一次桶，按帧、桶、类型计数后沿半径方向累加
+    near_frames, near_types, near_buckets = near_obstacles(frame_store, near_distances)
+    if obs_type_vocab is None:
+        obs_type_vocab = update_obs_type_vocab(type_ids_of(frame_store, near_types))
+    other_column = OBS_TYPE_VOCAB_CAPACITY
+    # type_code -> column，最后一个元素对应 type_code 为 -1 的情况
+    code_columns = np.array([min(obs_type_vocab.get(type_id, other_column), other_column)
+                             for type_id in frame_store['type_ids']] + [other_column], dtype=np.int64)
+
+    radius_count = len(near_distances)
+
+    column_count = OBS_TYPE_VOCAB_CAPACITY + 1
+    frame_count = frame_store['frame_count']
+    counts = np.bincount((near_frames * radius_count + near_buckets) * column_count + code_columns[near_types],
+                         minlength=frame_count * radius_count * column_count)
+    counts = np.cumsum(counts.reshape(frame_count, radius_count, column_count), axis=1)
+
+    obs_action_vecs = {}
+    for near_distance, column in zip(near_distances, radius_columns(near_distances)):
+        obs_type_num_vec = counts[:, column]
+        obs_types_vec = (obs_type_num_vec > 0).astype(int)
+        obstacle_actions = np.concatenate([obs_types_vec, deal_floor_array(obs_type_num_vec)], axis=1)
+        obs_action_vecs[near_distance] = obstacle_actions.tolist()
+    return obs_action_vecs
+
+
+
+class StageProfiler:
+    # record2vec 的分阶段统计：墙钟时间、CPU时间、tracemalloc 峰值内存，以及每 N 帧的累计情况
+    # 同名阶段可以被多次进入（例如逐帧的 frame split / actor parse），结果累加
+    def __init__(self, frame_interval=100, trace_memory=True):
+        self.frame_interval = frame_interval
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.frame_marks = []
+        self.started_tracemalloc = False
+        self.start_wall = self.start_cpu = 0.0
+        self.total_wall = self.total_cpu = 0.0
+        self.last_mark = (0, 0.0, 0.0)
+        self.interval_peak = 0
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.last_mark = (0, self.start_wall, self.start_cpu)
+
+    def stop(self):
+        self.total_wall = time.perf_counter() - self.start_wall
+        self.total_cpu = time.process_time() - self.start_cpu
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def memory(self):
+        if self.trace_memory and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()
+        return 0, 0
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start_current = self.memory()[0]
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            peak = self.memory()[1]
+            stage = self.stages.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                                                  'peak_bytes': 0, 'peak_delta_bytes': 0})
+            stage['calls'] += 1
+            stage['wall'] += wall
+            stage['cpu'] += cpu
+            stage['peak_bytes'] = max(stage['peak_bytes'], peak)
+            stage['peak_delta_bytes'] = max(stage['peak_delta_bytes'], peak - start_current)
+            self.interval_peak = max(self.interval_peak, peak)
+
+    def mark_frame(self, frame_count):
+        # 每 frame_interval 帧记录一次这段时间内的耗时和内存
+        if frame_count % self.frame_interval:
+            return
+        last_frame, last_wall, last_cpu = self.last_mark
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        self.frame_marks.append({
+            'frames': [last_frame, frame_count],
+            'wall': wall - last_wall,
+            'cpu': cpu - last_cpu,
+            'current_bytes': self.memory()[0],
+            'peak_bytes': self.interval_peak,
+        })
+        self.last_mark = (frame_count, wall, cpu)
+        self.interval_peak = 0
+
+    def summary_table(self):
+        # cpu/wall 明显小于1说明在等待I/O
+        lines = [f"{'stage':<24}{'calls':>8}{'wall(s)':>11}{'cpu(s)':>11}{'cpu/wall':>10}{'peak(MB)':>11}"]
+        for name, stage in self.stages.items():
+            ratio = stage['cpu'] / stage['wall'] if stage['wall'] else 0.0
+            lines.append(f"{name:<24}{stage['calls']:>8}{stage['wall']:>11.4f}{stage['cpu']:>11.4f}"
+                         f"{ratio:>10.2f}{stage['peak_bytes'] / 1024 ** 2:>11.2f}")
+        lines.append(f"{'total':<24}{'':>8}{self.total_wall:>11.4f}{self.total_cpu:>11.4f}")
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        return {
+            'total': {'wall': self.total_wall, 'cpu': self.total_cpu},
+            'trace_memory': self.trace_memory,
+            'stages': [dict(stage, name=name) for name, stage in self.stages.items()],
+            'frame_interval': self.frame_interval,
+            'frames': self.frame_marks,
+        }
+
+    def save_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False, indent=2)
+
+
+def profile_stage(profiler, name):
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
+
+
+def record2vec(file_path=LOG_FILE_PATH, use_cache=True, profiler=None):
+    # profiler 为 StageProfiler 时记录每个阶段的耗时和内存
+    if profiler is not None:
+        profiler.start()
+    if use_cache:
+        map_obj, frame_store = load_frame_store(file_path, profiler=profiler)
+    elif is_state_record(file_path):
+        map_obj, frame_store = load_state_record(file_path, profiler)
+    else:
+        map_obj, frame_iter = open_log_stream(file_path, profiler, projection=FRAME_STORE_FIELDS)
+        frame_store = build_frame_store(frame_iter, profiler)
+    with profile_stage(profiler, 'scene vec'):
+        scene_vec = create_scene_vecs(frame_store, map_obj)
+    with profile_stage(profiler, 'actor vec'):
+        actor_vec = create_actor_vecs(frame_store, map_obj)
+    with profile_stage(profiler, 'ego action vec'):
+        ego_action_vec = create_ego_action_vec(frame_store, map_obj)
+    with profile_stage(profiler, 'obs action vec'):
+        obs_action_vec = create_obs_action_vec(frame_store, map_obj)
+
+    with profile_stage(profiler, 'denoise scene vec'):
+        scene_vec = vec_denoise_v3(scene_vec, 3)
+    with profile_stage(profiler, 'denoise actor vec'):
+        actor_vec = vec_denoise_v3(actor_vec, 3)
+    with profile_stage(profiler, 'denoise ego action vec'):
+        ego_action_vec = vec_denoise_v3(ego_action_vec, 3)
+    with profile_stage(profiler, 'denoise obs action vec'):
+        obs_action_vec = vec_denoise_v3(obs_action_vec, 3)
+    if profiler is not None:
+        profiler.stop()
 
     record_data = {
         'scene_vec': scene_vec,
@@ -281,6 +506,635 @@ def record2vec():
         'ego_action_vec': ego_action_vec,
         'obs_action_vec': obs_action_vec
     }
+    return record_data
+
+
+def live_record2vec(file_path=LOG_FILE_PATH, window_size=3, poll_interval=0.2, idle_timeout=None, on_frame=None):
+    # 跟随正在写入的日志，逐帧增量生成四种向量，并以固定 window_size 帧的延迟做流式去噪
+    # 日志在 idle_timeout 秒内没有新数据（或 Ctrl+C）时结束，返回与 record2vec 相同结构的 record_data
+    # on_frame(frame_number, raw_vecs, denoised_vecs) 在每帧解析后回调，denoised_vecs 中是本帧新产出的去噪结果
+    vec_names = ['scene_vec', 'actor_vec', 'ego_action_vec', 'obs_action_vec']
+    denoisers = {name: StreamingDenoiser(window_size) for name in vec_names}
+    record_data = {name: [] for name in vec_names}
+    obs_type_vocab = load_obs_type_vocab()
+    pre_frame_store = None
+
+    map_obj, frame_iter = open_log_stream(file_path, follow=True, poll_interval=poll_interval,
+                                          idle_timeout=idle_timeout, projection=FRAME_STORE_FIELDS)
+    try:
+        for frame_number, frame_obj in enumerate(frame_iter):
+            frame_store = build_frame_store([frame_obj])
+            type_ids = near_type_ids(frame_store, [OBS_NEAR_DISTANCE])
+            if any(type_id not in obs_type_vocab for type_id in type_ids):
+                obs_type_vocab = update_obs_type_vocab(type_ids)
+            # 速度变化需要和上一帧比较
+            if pre_frame_store is None:
+                ego_action_vec = create_ego_action_vec(frame_store, map_obj)[-1]
+            else:
+                ego_action_vec = create_ego_action_vec(merge_frame_stores([pre_frame_store, frame_store]), map_obj)[-1]
+            raw_vecs = {
+                'scene_vec': create_scene_vecs(frame_store, map_obj)[0],
+                'actor_vec': create_actor_vecs(frame_store, map_obj)[0],
+                'ego_action_vec': ego_action_vec,
+                'obs_action_vec': create_obs_action_vec(frame_store, map_obj, obs_type_vocab=obs_type_vocab)[0],
+            }
+            denoised_vecs = {}
+            for name in vec_names:
+                denoised_vecs[name] = denoisers[name].push(raw_vecs[name])
+                record_data[name] += denoised_vecs[name]
+            pre_frame_store = frame_store
+            if on_frame is not None:
+                on_frame(frame_number, raw_vecs, denoised_vecs)
+    except KeyboardInterrupt:
+        frame_iter.close()
+    return record_data
+
+
+def print_live_frame(frame_number, raw_vecs, denoised_vecs):
+    print(f"frame {frame_number}: scene {raw_vecs['scene_vec']} actor {raw_vecs['actor_vec']} "
+          f"ego_action {raw_vecs['ego_action_vec']}")
+    if denoised_vecs['scene_vec']:
+        print(f"  denoised scene {denoised_vecs['scene_vec'][0]} actor {denoised_vecs['actor_vec'][0]} "
+              f"ego_action {denoised_vecs['ego_action_vec'][0]}")
+
+
+def parse_cache_key(file_path, use_content_hash=False):
+    # 默认用 路径+大小+修改时间 作为key，use_content_hash=True 时对文件内容做哈希
+    stat = os.stat(file_path)
+    digest = hashlib.blake2b(f"parser-v{PARSER_VERSION}".encode('utf-8'), digest_size=20)
+    if use_content_hash:
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    else:
+        digest.update(f"|{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def evict_parse_cache(cache_dir=PARSE_CACHE_DIR, max_bytes=PARSE_CACHE_MAX_BYTES):
+    # 超过容量时按最近使用时间从旧到新删除缓存文件
+    # 写入进程被终止时留下的 .tmp 文件超过 PARSE_CACHE_TMP_MAX_AGE 秒后删除（正在写入的文件不会这么旧）
+    entries = []
+    now = time.time()
+    for entry in os.scandir(cache_dir):
+        if not entry.is_file():
+            continue
+        if entry.name.endswith('.pkl'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        elif entry.name.endswith('.tmp') and now - entry.stat().st_mtime > PARSE_CACHE_TMP_MAX_AGE:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def load_frame_store(file_path=LOG_FILE_PATH, cache_dir=PARSE_CACHE_DIR, max_bytes=PARSE_CACHE_MAX_BYTES,
+                     use_content_hash=False, profiler=None):
+    # 解析结果 (map_obj, frame_store) 以 pickle 二进制缓存，日志不变时直接读取缓存
+    # 二进制状态记录文件读取很快，不需要缓存
+    if is_state_record(file_path):
+        return load_state_record(file_path, profiler)
+    cache_path = os.path.join(cache_dir, parse_cache_key(file_path, use_content_hash) + '.pkl')
+    if os.path.exists(cache_path):
+        try:
+            with profile_stage(profiler, 'cache load'):
+                with open(cache_path, 'rb') as file:
+                    map_obj, frame_store = pickle.load(file)
+            # 更新修改时间，作为LRU淘汰的依据
+            os.utime(cache_path)
+            return map_obj, frame_store
+        except Exception:
+            # 文件损坏，或由不同版本的 numpy / 本模块写入而无法读取：删除后重新解析
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+
+    map_obj, frame_iter = open_log_stream(file_path, profiler, projection=FRAME_STORE_FIELDS)
+    frame_store = build_frame_store(frame_iter, profiler)
+    with profile_stage(profiler, 'cache save'):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            pickle.dump((map_obj, frame_store), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        evict_parse_cache(cache_dir, max_bytes)
+    return map_obj, frame_store
+
+
+def frame_index_path(file_path):
+    return file_path + '.idx.npz'
+
+
+def build_frame_index(file_path):
+    # 扫描一遍日志，记录 map 头、每一帧以及帧内每个 "*" * 70 分段的字节偏移
+    stat = os.stat(file_path)
+    star70, star80, star90 = b"*" * 70, b"*" * 80, b"*" * 90
+    map_end = stat.st_size
+    frames = []
+    sections = []
+    if stat.st_size:
+        with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            in_frames = False
+            frame_start = section_start = 0
+            section_bounds = []
+            pos = mm.find(star70)
+            while pos != -1:
+                line_start = mm.rfind(b'\n', 0, pos) + 1
+                line_end = mm.find(b'\n', pos)
+                line_end = len(mm) if line_end == -1 else line_end + 1
+                is_frame_end = mm[pos:pos + 80] == star80
+                if not in_frames:
+                    # 第一条 "*" * 90 之前都是 map 数据
+                    if mm[pos:pos + 90] == star90:
+                        map_end = line_start
+                        in_frames = True
+                        frame_start = section_start = line_end
+                else:
+                    section_bounds.append((section_start, line_start))
+                    section_start = line_end
+                    if is_frame_end:
+                        section_bounds = section_bounds[:FRAME_INDEX_SECTIONS]
+                        section_bounds += [(-1, -1)] * (FRAME_INDEX_SECTIONS - len(section_bounds))
+                        frames.append((frame_start, line_start))
+                        sections.append(section_bounds)
+                        section_bounds = []
+                        frame_start = line_end
+                pos = mm.find(star70, line_end)
+
+    return {
+        'map_end': map_end,
+        'frames': np.array(frames, dtype=np.int64).reshape(-1, 2),
+        'sections': np.array(sections, dtype=np.int64).reshape(-1, FRAME_INDEX_SECTIONS, 2),
+        'log_size': stat.st_size,
+        'log_mtime_ns': stat.st_mtime_ns,
+    }
+
+
+def load_frame_index(file_path):
+    # 读取日志旁边的 .idx.npz 索引文件，日志大小或修改时间变化时重新建立索引
+    stat = os.stat(file_path)
+    index_path = frame_index_path(file_path)
+    if os.path.exists(index_path):
+        with np.load(index_path) as data:
+            frame_index = {key: data[key] for key in data.files}
+        for key in ['map_end', 'log_size', 'log_mtime_ns']:
+            frame_index[key] = int(frame_index[key])
+        if frame_index['log_size'] == stat.st_size and frame_index['log_mtime_ns'] == stat.st_mtime_ns:
+            return frame_index
+
+    frame_index = build_frame_index(file_path)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **frame_index)
+    os.replace(tmp_path, index_path)
+    return frame_index
+
+
+@contextmanager
+def open_log_mmap(file_path):
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield mm
+
+
+def read_map_obj(mm, frame_index):
+    return buildMapObj(decode_log_bytes(mm[:frame_index['map_end']]))
+
+
+def read_frame_obj(mm, frame_index, frame_number, projection=None):
+    start, end = frame_index['frames'][frame_number]
+    return build_frame_obj(decode_log_bytes(mm[start:end]), projection)
+
+
+def read_frame_section(mm, frame_index, frame_number, section):
+    # section: 0 时间 1 车辆 2 信号灯 3 交通标识 4 行人
+    start, end = frame_index['sections'][frame_number, section]
+    if start < 0:
+        return ''
+    return decode_log_bytes(mm[start:end])
+
+
+def preview_frame(file_path, frame_number):
+    # 只解析指定的一帧，不需要读取整个日志
+    frame_index = load_frame_index(file_path)
+    with open_log_mmap(file_path) as mm:
+        return read_frame_obj(mm, frame_index, frame_number)
+
+
+def parse_frame_range(file_path, start, stop):
+    frame_index = load_frame_index(file_path)
+    with open_log_mmap(file_path) as mm:
+        return build_frame_store(read_frame_obj(mm, frame_index, frame_number, FRAME_STORE_FIELDS)
+                                 for frame_number in range(start, min(stop, len(frame_index['frames']))))
+
+
+def empty_actor_rows(frame_indexes):
+    # 与 build_actor_row({}) 相同的空数据
+    rows = np.zeros(len(frame_indexes), dtype=ACTOR_DTYPE)
+    rows['frame'] = frame_indexes
+    for field in ['id', 'type_code', 'role', 'traffic_light_state']:
+        rows[field] = -1
+    for field in ['location', 'velocity', 'forward', 'velocity_value', 'steering_angle', 'ego_distance']:
+        rows[field] = np.nan
+    return rows
+
+
+def record_actor_rows(records, frames, type_map, role_map):
+    # 把状态记录转换成 frame_store 的行，字符串编码重新映射为 type_ids / role_names 中的编码
+    rows = empty_actor_rows(frames)
+    names = records.dtype.names
+    rows['id'] = records['id']
+    rows['type_code'] = type_map[records['type_code']]
+    if 'role' in names:
+        rows['role'] = role_map[records['role']]
+    rows['location'] = records['transform'][:, :3]
+    rows['forward'] = forward_vectors(records['transform'])
+    if 'velocity' in names:
+        rows['velocity'] = records['velocity']
+        rows['velocity_value'] = np.linalg.norm(records['velocity'].astype(np.float64), axis=1)
+    if 'control' in names:
+        rows['steering_angle'] = records['control'][:, 1]
+    if 'traffic_light_state' in names:
+        rows['traffic_light_state'] = records['traffic_light_state']
+    if 'is_walker_on_road' in names:
+        rows['is_walker_on_road'] = records['is_walker_on_road']
+    return rows
+
+
+def load_state_record(file_path, profiler=None):
+    # 直接读取采集脚本写出的二进制状态记录（state_recorder.py），不经过文本解析
+    # 每帧第一个 role_name 为 hero 的车辆作为ego，其余 hero 车辆与文本日志一样被忽略
+    with profile_stage(profiler, 'load'):
+        header, frame_iter = open_state_record(file_path)
+        map_obj = dict(header['map'], crosswalks=[])
+        if 'map_geometry_cache' in map_obj:
+            map_obj['map_geometry'] = find_map_geometry(map_obj['map_geometry_cache'])
+
+    times = []
+    chunks = {actor_class: [] for actor_class in RECORD_CLASSES}
+    frames = {actor_class: [] for actor_class in RECORD_CLASSES}
+    strings = []
+    with profile_stage(profiler, 'frame store'):
+        for frame_index, (frame_time, rows, strings) in enumerate(frame_iter):
+            times.append(frame_time)
+            for actor_class in RECORD_CLASSES:
+                chunks[actor_class].append(rows[actor_class])
+                frames[actor_class].append(np.full(len(rows[actor_class]), frame_index, dtype=np.int32))
+        frame_count = len(times)
+        records = {actor_class: np.concatenate(chunks[actor_class]) if chunks[actor_class] else
+                   np.zeros(0, dtype=RECORD_DTYPES[actor_class]) for actor_class in RECORD_CLASSES}
+        frames = {actor_class: np.concatenate([np.zeros(0, dtype=np.int32)] + frames[actor_class])
+                  for actor_class in RECORD_CLASSES}
+
+        # 记录文件中类型和 role_name 共用一张字符串表，这里拆成 type_ids 和 role_names 两个词表
+        type_ids, type_codes = [], {}
+        role_names, role_codes = [], {}
+        used_types = np.unique(np.concatenate([records[actor_class]['type_code'] for actor_class in RECORD_CLASSES]))
+        type_map = np.full(len(strings) + 1, -1, dtype=np.int32)
+        for code in used_types[used_types >= 0]:
+            type_map[code] = get_code(strings[code], type_ids, type_codes)
+        role_map = np.full(len(strings) + 1, -1, dtype=np.int32)
+        for code in np.unique(records['vehicle']['role'][records['vehicle']['role'] >= 0]):
+            role_map[code] = get_code(strings[code], role_names, role_codes)
+
+        vehicles = records['vehicle']
+        vehicle_frames = frames['vehicle']
+        is_hero = role_map[vehicles['role']] == role_codes.get('hero', -2)
+        hero_rows = np.nonzero(is_hero)[0]
+        ego_frames, first = np.unique(vehicle_frames[hero_rows], return_index=True)
+        ego = empty_actor_rows(np.arange(frame_count, dtype=np.int32))
+        ego[ego_frames] = record_actor_rows(vehicles[hero_rows[first]], ego_frames, type_map, role_map)
+
+        frame_store = {
+            'frame_count': frame_count,
+            'time': np.array(times, dtype=np.float64),
+            'type_ids': type_ids,
+            'role_names': role_names,
+            'offsets': {},
+            'ego': ego,
+            'vehicle': record_actor_rows(vehicles[~is_hero], vehicle_frames[~is_hero], type_map, role_map),
+        }
+        for actor_class in RECORD_CLASSES[1:]:
+            frame_store[actor_class] = record_actor_rows(records[actor_class], frames[actor_class], type_map, role_map)
+        for actor_class in ACTOR_CLASSES:
+            frame_store['offsets'][actor_class] = np.searchsorted(frame_store[actor_class]['frame'],
+                                                                  np.arange(frame_count + 1))
+
+    with profile_stage(profiler, 'distance'):
+        calc_ego_distance(frame_store)
+    return map_obj, frame_store
+
+
+def merge_frame_stores(frame_stores):
+    # 按顺序拼接多个 frame_store，重新映射 type_id / role_name 编码
+    type_ids, type_codes = [], {}
+    role_names, role_codes = [], {}
+    chunks = {actor_class: [] for actor_class in ACTOR_CLASSES}
+    offsets = {actor_class: [np.zeros(1, dtype=np.int64)] for actor_class in ACTOR_CLASSES}
+    frame_base = 0
+    for frame_store in frame_stores:
+        # 最后一个元素对应编码 -1
+        type_map = np.array([get_code(type_id, type_ids, type_codes) for type_id in frame_store['type_ids']] + [-1])
+        role_map = np.array([get_code(role, role_names, role_codes) for role in frame_store['role_names']] + [-1])
+        for actor_class in ACTOR_CLASSES:
+            actors = frame_store[actor_class].copy()
+            actors['frame'] += frame_base
+            actors['type_code'] = type_map[actors['type_code']]
+            actors['role'] = role_map[actors['role']]
+            row_base = offsets[actor_class][-1][-1]
+            chunks[actor_class].append(actors)
+            offsets[actor_class].append(frame_store['offsets'][actor_class][1:] + row_base)
+        frame_base += frame_store['frame_count']
+
+    merged = {
+        'frame_count': frame_base,
+        'time': np.concatenate([np.zeros(0)] + [frame_store['time'] for frame_store in frame_stores]),
+        'type_ids': type_ids,
+        'role_names': role_names,
+        'offsets': {actor_class: np.concatenate(offsets[actor_class]) for actor_class in ACTOR_CLASSES},
+    }
+    for actor_class in ACTOR_CLASSES:
+        merged[actor_class] = np.concatenate([np.zeros(0, dtype=ACTOR_DTYPE)] + chunks[actor_class])
+    return merged
+
+
+def parallel_build_frame_store(file_path, workers=None, frames_per_task=500):
+    # 按帧范围切分，用进程池并行解析同一个日志
+    frame_index = load_frame_index(file_path)
+    frame_total = len(frame_index['frames'])
+    with open_log_mmap(file_path) as mm:
+        map_obj = read_map_obj(mm, frame_index)
+    starts = list(range(0, frame_total, frames_per_task))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        frame_stores = list(executor.map(parse_frame_range, [file_path] * len(starts), starts,
+                                         [start + frames_per_task for start in starts]))
+    return map_obj, merge_frame_stores(frame_stores)
+
+
+def list_log_files(log_pattern):
+    # 参数可以是目录（处理目录下所有 .log 和 .rec 文件），也可以是 glob 模式
+    if os.path.isdir(log_pattern):
+        log_files = glob.glob(os.path.join(log_pattern, '*.log')) + glob.glob(os.path.join(log_pattern, '*.rec'))
+    else:
+        log_files = glob.glob(log_pattern, recursive=True)
+    # 同一个文件只处理一次（输出文件名由绝对路径决定，不同文件不会重名）
+    return sorted({os.path.abspath(file_path): file_path for file_path in log_files}.values())
+
+
+def vec_output_name(file_path):
+    # 向量文件名保留日志的扩展名，并加上日志绝对路径的哈希：
+    # a.log 与 a.rec、不同目录下的同名日志（例如每天的 myapp6.log）各自输出一个文件，同一个日志重复处理时覆盖自己的输出
+    path_hash = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:8]
+    return f"{os.path.basename(file_path)}.{path_hash}.npz"
+
+
+def record2vec_file(file_path, output_dir):
+    # 进程池中执行：处理一个日志并保存向量文件，异常信息以字符串形式返回
+    start_time = time.time()
+    result = {
+        'log': file_path,
+        'output': None,
+        'status': 'ok',
+        'seconds': 0.0,
+        'frames': 0,
+        'segments': 0,
+        'error': None,
+    }
+    output_path = os.path.join(output_dir, vec_output_name(file_path))
+    try:
+        record_data = record2vec(file_path)
+        frame_codes = encode_segment_codes(record_data)
+        segments = split_segments(record_data, frame_codes)
+        # 先写临时文件再改名，建索引时不会读到写了一半的向量文件
+        tmp_path = f"{output_path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp_path,
+                            segment_start=segments['start'], segment_end=segments['end'],
+                            segment_code=segments['code'], frame_code=frame_codes.astype(np.uint32),
+                            log_path=os.path.abspath(file_path),
+                            **{key: np.array(vec, dtype=np.int16) for key, vec in record_data.items()})
+        os.replace(tmp_path, output_path)
+        result['output'] = output_path
+        result['frames'] = len(record_data['scene_vec'])
+        result['segments'] = len(segments['code'])
+    except Exception:
+        result['status'] = 'failed'
+        result['error'] = traceback.format_exc()
+        # 删除之前成功时留下的向量文件，分段索引与 manifest 保持一致，不会检索到失败日志的旧结果
+        try:
+            os.remove(output_path)
+        except FileNotFoundError:
+            pass
+    result['seconds'] = time.time() - start_time
+    return result
+
+
+def batch_record2vec(log_pattern, output_dir, workers=None):
+    # 用进程池并行处理多个日志，每个日志输出一个 .npz 向量文件，并写出 manifest.json
+    log_files = list_log_files(log_pattern)
+    os.makedirs(output_dir, exist_ok=True)
+    start_time = time.time()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(record2vec_file, file_path, output_dir) for file_path in log_files]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f"[{len(results)}/{len(log_files)}] {result['status']} {result['log']} "
+                  f"frames: {result['frames']} time: {result['seconds']:.2f}s")
+            if result['error']:
+                print(result['error'])
+
+    failed = [result for result in results if result['status'] != 'ok']
+    seconds = time.time() - start_time
+    # 同一个输出目录可以分多次处理新的日志：manifest 与之前的记录合并，分段索引包含目录下所有的向量文件
+    manifest = update_manifest(output_dir, results, seconds)
+    build_segment_index(list_vec_files(output_dir), os.path.join(output_dir, SEGMENT_INDEX_NAME))
+    print(f"done: {len(results) - len(failed)} ok, {len(failed)} failed, total time: {seconds:.2f}s, "
+          f"logs in {output_dir}: {manifest['log_count']}")
+    return manifest
+
+
+def update_manifest(output_dir, results, seconds):
+    # 按日志的绝对路径合并，重新处理的日志使用本次的结果
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    files = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            for item in json.load(file)['files']:
+                files[os.path.abspath(item['log'])] = item
+    for result in results:
+        files[os.path.abspath(result['log'])] = result
+    files = sorted(files.values(), key=lambda item: item['log'])
+    manifest = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'log_count': len(files),
+        'failed_count': sum(item['status'] != 'ok' for item in files),
+        'seconds': seconds,
+        'files': files,
+    }
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def list_vec_files(output_dir):
+    # 输出目录下所有日志的向量文件，不包括分段索引和写入中的临时文件
+    return sorted(path for path in glob.glob(os.path.join(output_dir, '*.npz'))
+                  if os.path.basename(path) != SEGMENT_INDEX_NAME and not path.endswith('.tmp.npz'))
+
+
+def encode_segment_codes(record_data):
+    # 把每一行的 scene/actor/ego_action 向量按 SEGMENT_COLUMNS 的顺序压缩成一个整数
+    vecs = np.concatenate([np.array(record_data[key], dtype=np.int64).reshape(-1, len(columns))
+                           for key, columns in [('scene_vec', SCENE_VEC_COLUMNS), ('actor_vec', ACTOR_VEC_COLUMNS),
+                                                ('ego_action_vec', EGO_ACTION_VEC_COLUMNS)]], axis=1)
+    return (vecs > 0) @ (np.int64(1) << np.arange(len(SEGMENT_COLUMNS), dtype=np.int64))
+
+
+def split_segments(record_data, codes=None):
+    # 对去噪后的向量做游程编码：编码相同的连续行合并成一段，start / end 都是包含在段内的行号
+    if codes is None:
+        codes = encode_segment_codes(record_data)
+    if len(codes) == 0:
+        return {'start': np.zeros(0, dtype=np.int32), 'end': np.zeros(0, dtype=np.int32), 'code': codes}
+    starts = np.concatenate([[0], np.nonzero(codes[1:] != codes[:-1])[0] + 1]).astype(np.int32)
+    ends = np.append(starts[1:] - 1, len(codes) - 1).astype(np.int32)
+    return {'start': starts, 'end': ends, 'code': codes[starts]}
+
+
+def decode_segment_code(code):
+    # 返回编码中为1的列名
+    return [column for bit, column in enumerate(SEGMENT_COLUMNS) if int(code) >> bit & 1]
+
+
+def segment_condition_mask(conditions):
+    # conditions: {列名: 0/1}，返回 (mask, value)，满足 code & mask == value 的段符合条件
+    mask = value = 0
+    for column, flag in conditions.items():
+        if column not in SEGMENT_COLUMNS:
+            raise ValueError(f"未知的分段列: {column}，可选: {', '.join(SEGMENT_COLUMNS)}")
+        bit = 1 << SEGMENT_COLUMNS.index(column)
+        mask |= bit
+        if flag:
+            value |= bit
+    return mask, value
+
+
+def build_segment_index(vec_paths, index_path):
+    # 汇总多个日志的分段，按编码排序后保存；codes 为去重后的编码，code_offsets 指向每种编码的段
+    # frame_codes 为所有日志逐行的编码（uint32，每列一位），frame_offsets 为每个日志第一行的位置，用于相似场景检索
+    logs, log_paths, log_ids, starts, ends, codes = [], [], [], [], [], []
+    frame_codes, frame_offsets = [], [0]
+    for vec_path in sorted(vec_paths):
+        with np.load(vec_path) as data:
+            if 'segment_code' not in data.files:
+                continue
+            log_ids.append(np.full(len(data['segment_code']), len(logs), dtype=np.int32))
+            starts.append(data['segment_start'])
+            ends.append(data['segment_end'])
+            codes.append(data['segment_code'])
+            frame_codes.append(data['frame_code'])
+            frame_offsets.append(frame_offsets[-1] + len(data['frame_code']))
+            log_paths.append(str(data['log_path']) if 'log_path' in data.files else '')
+        logs.append(os.path.splitext(os.path.basename(vec_path))[0])
+
+    log_ids = np.concatenate([np.zeros(0, dtype=np.int32)] + log_ids)
+    starts = np.concatenate([np.zeros(0, dtype=np.int32)] + starts)
+    ends = np.concatenate([np.zeros(0, dtype=np.int32)] + ends)
+    codes = np.concatenate([np.zeros(0, dtype=np.int64)] + codes)
+    order = np.lexsort((starts, log_ids, codes))
+    unique_codes, code_starts = np.unique(codes[order], return_index=True)
+    segment_index = {
+        'columns': np.array(SEGMENT_COLUMNS),
+        'logs': np.array(logs, dtype=str),
+        'log_paths': np.array(log_paths, dtype=str),
+        'codes': unique_codes,
+        'code_offsets': np.append(code_starts, len(order)).astype(np.int64),
+        'log_id': log_ids[order],
+        'start': starts[order],
+        'end': ends[order],
+        'frame_codes': np.concatenate([np.zeros(0, dtype=np.uint32)] + frame_codes),
+        'frame_offsets': np.array(frame_offsets, dtype=np.int64),
+    }
+    tmp_path = f"{index_path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp_path, **segment_index)
+    os.replace(tmp_path, index_path)
+    return segment_index
+
+
+def load_segment_index(index_path):
+    with np.load(index_path) as data:
+        segment_index = {key: data[key] for key in data.files}
+    if segment_index['columns'].tolist() != SEGMENT_COLUMNS:
+        raise ValueError(f"分段索引的列与当前版本不一致，需要重新生成: {index_path}")
+    return segment_index
+
+
+def query_segments(segment_index, **conditions):
+    # 例如 query_segments(index, turn_left=1, red=1, crossing_vehicle=1)
+    # 只在去重后的编码上做位运算，再按 code_offsets 取出对应的段，不需要扫描逐帧向量
+    mask, value = segment_condition_mask(conditions)
+    matched = np.nonzero((segment_index['codes'] & mask) == value)[0]
+    offsets = segment_index['code_offsets']
+    rows = np.concatenate([np.zeros(0, dtype=np.int64)] +
+                          [np.arange(offsets[i], offsets[i + 1]) for i in matched])
+    # 按日志、起始行排序输出
+    rows = rows[np.lexsort((segment_index['start'][rows], segment_index['log_id'][rows]))]
+    logs = segment_index['logs']
+    return [(str(logs[segment_index['log_id'][row]]), int(segment_index['start'][row]), int(segment_index['end'][row]))
+            for row in rows]
+
+
+def popcount(values):
+    # 逐元素统计二进制中1的个数
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    values = np.ascontiguousarray(values)
+    return POPCOUNT_TABLE[values.view(np.uint8)].reshape(len(values), -1).sum(axis=1)
+
+
+def get_frame_code(segment_index, log, frame):
+    log_id = segment_index['logs'].tolist().index(log)
+    offsets = segment_index['frame_offsets']
+    if not 0 <= frame < offsets[log_id + 1] - offsets[log_id]:
+        raise IndexError(f"{log} 没有第 {frame} 行")
+    return segment_index['frame_codes'][offsets[log_id] + frame]
+
+
+def search_similar_frames(segment_index, query_code, top_k=10, chunk_size=1 << 22):
+    # 按汉明距离（异或后数1的个数）返回最相近的 top_k 行: [(日志, 行号, 距离), ...]
+    # 分块计算，每块只保留前 top_k 个，内存占用与 chunk_size 相关而与语料大小无关
+    frame_codes = segment_index['frame_codes']
+    query_code = frame_codes.dtype.type(query_code)
+    best_rows = np.zeros(0, dtype=np.int64)
+    best_distances = np.zeros(0, dtype=np.int64)
+    for chunk_start in range(0, len(frame_codes), chunk_size):
+        distances = popcount(frame_codes[chunk_start:chunk_start + chunk_size] ^ query_code).astype(np.int64)
+        rows = np.arange(chunk_start, chunk_start + len(distances))
+        if len(distances) > top_k:
+            keep = np.argpartition(distances, top_k - 1)[:top_k]
+            rows, distances = rows[keep], distances[keep]
+        best_rows = np.concatenate([best_rows, rows])
+        best_distances = np.concatenate([best_distances, distances])
+        # 距离相同时行号小的优先
+        order = np.lexsort((best_rows, best_distances))[:top_k]
+        best_rows, best_distances = best_rows[order], best_distances[order]
+
+    logs = segment_index['logs']
+    log_ids = np.searchsorted(segment_index['frame_offsets'], best_rows, side='right') - 1
+    return [(str(logs[log_id]), int(row - segment_index['frame_offsets'][log_id]), int(distance))
+            for log_id, row, distance in zip(log_ids, best_rows, best_distances)]
 
 
 def buildMapObj(mapstring):
@@ -304,380 +1158,632 @@ def buildMapObj(mapstring):
             if "x" not in junction_obj:
                 junctions.append(junction_obj)
         map_obj['junctions'] = junctions
+    # 新的采集脚本只记录地图几何缓存文件的路径，人行横道、交叉路口、信号灯位置从缓存中读取
+    if 'map_geometry_cache' in map_obj:
+        map_obj['map_geometry'] = find_map_geometry(map_obj['map_geometry_cache'])
     return map_obj
 
 
-def build_frame_obj_list():
-    # 1、读取数据，从data文件夹下面读取数据
-    log_data = loadlog()
-    # 使用 "*" * 90 分离map数据
-    splitflag = "*" * 90
-    log_arr = log_data.split(splitflag)
-    mapstring = log_arr[0]
-    map_obj = buildMapObj(mapstring)
-    # 使用 "*" * 80 分离每一帧的数据
-    splitflag = "*" * 80
-    frams = log_arr[1].split(splitflag)
-    frams = frams[:-1]
-    # frams = frams[1:]
-    # 用来存储string[]
-    frames_msg = []
-    frames_obj_list = []
-
-    for fram in frams:
-        frame_msg = {}
-        frame_obj = {}
-
-        vehicle_obj_list = []
-        ego_obj_list = []
-        traffic_light_obj_list = []
-        traffic_sign_obj_list = []
-        pedestrian_obj_list = []
-
-        frame_obj['vehicle_obj_list'] = vehicle_obj_list
-        frame_obj['ego_obj_list'] = ego_obj_list
-        frame_obj['traffic_light_obj_list'] = traffic_light_obj_list
-        frame_obj['traffic_sign_obj_list'] = traffic_sign_obj_list
-        frame_obj['pedestrian_obj_list'] = pedestrian_obj_list
-        frames_obj_list.append(frame_obj)
-        vehicle_msg = []
-
-        frame_msg['vehicle_msg'] = vehicle_msg
-
-        splitflag = "*" * 70
-        msg = fram.split(splitflag)
-        t_msg = msg[0]
-        v_msgs = msg[1]
-        tl_msgs = msg[2]
-        ts_msgs = msg[3]
-        pedestrians_msgs = msg[4]
-
-        t_obj = msg2obj(t_msg)
-        frame_obj["time"] = t_obj['time']
-
-        # 对汽车进行处理
-        splitflag = "-" * 60
-        v_msg_arr = v_msgs.split(splitflag)
-        for v_msg in v_msg_arr:
-            obj = msg2obj(v_msg)
-            # 处理location对象
-            dealLocation(obj, "vehicle_location")
-            # 是ego还是背景车
-            if obj.get('role_name') == 'hero':
-                ego_obj_list.append(obj)
+def decode_log_bytes(data):
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        # 如果UTF-8编码失败，尝试使用GBK编码
+        return data.decode('gbk')
+
+
+def follow_log_lines(file, poll_interval=0.2, idle_timeout=None):
+    # 类似 tail -f：读到文件末尾时等待采集程序继续写入，只产出完整的行
+    # idle_timeout 秒内没有新数据时结束，None 表示一直等待
+    pending = b''
+    idle_since = time.time()
+    while True:
+        line = file.readline()
+        if line:
+            idle_since = time.time()
+            if line.endswith(b'\n'):
+                yield pending + line
+                pending = b''
             else:
-                vehicle_obj_list.append(obj)
-
-        # 对信号灯进行处理
-        splitflag = "+" * 40
-        tl_msg_arr = tl_msgs.split(splitflag)
-        for tl_msg in tl_msg_arr:
-            obj = msg2obj(tl_msg)
-            dealLocation(obj, "location")
-            if "location" in obj:
-                traffic_light_obj_list.append(obj)
-        # 处理交通标识
-        splitflag = "+" * 50
-        ts_msg_arr = ts_msgs.split(splitflag)
-        for ts_msg in ts_msg_arr:
-            obj = msg2obj(ts_msg)
-            dealLocation(obj, "location")
-            traffic_sign_obj_list.append(obj)
-        # 处理行人
-        splitflag = "+" * 40
-        pedestrians_arr = pedestrians_msgs.split(splitflag)
-        for pedestrian in pedestrians_arr:
-            obj = msg2obj(pedestrian)
-            dealLocation(obj, "location")
-            pedestrian_obj_list.append(obj)
-
-        # 计算与ego之间的距离
-        calc_ego_distance(frame_obj)
-        # break
+                pending += line
+            continue
+        if idle_timeout is not None and time.time() - idle_since > idle_timeout:
+            if pending:
+                yield pending
+            return
+        time.sleep(poll_interval)
+
+
+def wait_for_file(file_path, poll_interval=0.2, idle_timeout=None):
+    start_time = time.time()
+    while not os.path.exists(file_path):
+        if idle_timeout is not None and time.time() - start_time > idle_timeout:
+            raise FileNotFoundError(file_path)
+        time.sleep(poll_interval)
+
+
+def open_log_stream(file_path=LOG_FILE_PATH, profiler=None, follow=False, poll_interval=0.2, idle_timeout=None,
+                    projection=None):
+    # 逐行(按缓冲块)读取日志，先解析 "*" * 90 之前的map数据
+    # 返回 map_obj 和一个逐帧解析的生成器，内存占用只与单帧大小相关
+    # follow=True 时跟随正在写入的日志，每收到一个 "*" * 80 结束符就解析一帧
+    # 只需要生成 frame_store 时传入 projection=FRAME_STORE_FIELDS，其余字段不会被解析
+    if follow:
+        wait_for_file(file_path, poll_interval, idle_timeout)
+    file = open(file_path, 'rb')
+    if follow:
+        lines = follow_log_lines(file, poll_interval, idle_timeout)
+    else:
+        lines = file
+    map_flag = b"*" * 90
+    map_lines = []
+    try:
+        with profile_stage(profiler, 'load'):
+            for line in lines:
+                if map_flag in line:
+                    break
+                map_lines.append(line)
+            mapstring = decode_log_bytes(b''.join(map_lines))
+        with profile_stage(profiler, 'map build'):
+            map_obj = buildMapObj(mapstring)
+    except Exception:
+        file.close()
+        raise
+    return map_obj, iter_frame_objs(file, profiler, lines, projection)
+
+
+def iter_frame_objs(file, profiler=None, lines=None, projection=None):
+    # 使用 "*" * 80 分离每一帧的数据，最后一个不完整的帧会被丢弃
+    # lines 为逐行的迭代器，默认直接迭代 file；projection 为需要保留的字段集合
+    if lines is None:
+        lines = file
+    frame_flag = b"*" * 80
+    frame_lines = []
+    with file:
+        while True:
+            fram = None
+            with profile_stage(profiler, 'frame split'):
+                for line in lines:
+                    if frame_flag in line:
+                        fram = decode_log_bytes(b''.join(frame_lines))
+                        frame_lines = []
+                        break
+                    frame_lines.append(line)
+            if fram is None:
+                return
+            with profile_stage(profiler, 'actor parse'):
+                frame_obj = build_frame_obj(fram, projection)
+            yield frame_obj
+
+
+def build_frame_obj_list(file_path=LOG_FILE_PATH):
+    # 1、读取数据，从data文件夹下面流式读取数据
+    map_obj, frame_iter = open_log_stream(file_path)
+    frames_obj_list = list(frame_iter)
     # print('frames_obj_list:')
     # print(frames_obj_list)
     return frames_obj_list, map_obj
 
 
-def msg2obj(v_msg):
-    # 解析日志行的正则表达式
-    log_line_pattern = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - DEBUG - (\w+): (.+)",
-                                  re.UNICODE)
-    subpattern = r"(\w+_+\w+): (\S+)"
-    # 结果字典
-    obj = {}
-    # 遍历日志中的每一行
-    for line in v_msg.strip().split("\n"):
-        match = log_line_pattern.match(line)
+def build_frame_obj(fram, projection=None):
+    frame_obj = {}
+
+    vehicle_obj_list = []
+    ego_obj_list = []
+    traffic_light_obj_list = []
+    traffic_sign_obj_list = []
+    pedestrian_obj_list = []
+
+    frame_obj['vehicle_obj_list'] = vehicle_obj_list
+    frame_obj['ego_obj_list'] = ego_obj_list
+    frame_obj['traffic_light_obj_list'] = traffic_light_obj_list
+    frame_obj['traffic_sign_obj_list'] = traffic_sign_obj_list
+    frame_obj['pedestrian_obj_list'] = pedestrian_obj_list
+
+    splitflag = "*" * 70
+    msg = fram.split(splitflag)
+    t_msg = msg[0]
+    v_msgs = msg[1]
+    tl_msgs = msg[2]
+    ts_msgs = msg[3]
+    pedestrians_msgs = msg[4]
+
+    t_obj = msg2obj(t_msg, projection)
+    frame_obj["time"] = t_obj['time']
+
+    # 对汽车进行处理
+    splitflag = "-" * 60
+    v_msg_arr = v_msgs.split(splitflag)
+    for v_msg in v_msg_arr:
+        obj = msg2obj(v_msg, projection)
+        # 处理location对象
+        dealLocation(obj, "vehicle_location")
+        # 是ego还是背景车
+        if obj.get('role_name') == 'hero':
+            ego_obj_list.append(obj)
+        else:
+            vehicle_obj_list.append(obj)
+
+    # 对信号灯进行处理
+    splitflag = "+" * 40
+    tl_msg_arr = tl_msgs.split(splitflag)
+    for tl_msg in tl_msg_arr:
+        obj = msg2obj(tl_msg, projection)
+        dealLocation(obj, "location")
+        if "location" in obj:
+            traffic_light_obj_list.append(obj)
+    # 处理交通标识
+    splitflag = "+" * 50
+    ts_msg_arr = ts_msgs.split(splitflag)
+    for ts_msg in ts_msg_arr:
+        obj = msg2obj(ts_msg, projection)
+        dealLocation(obj, "location")
+        traffic_sign_obj_list.append(obj)
+    # 处理行人
+    splitflag = "+" * 40
+    pedestrians_arr = pedestrians_msgs.split(splitflag)
+    for pedestrian in pedestrians_arr:
+        obj = msg2obj(pedestrian, projection)
+        dealLocation(obj, "location")
+        pedestrian_obj_list.append(obj)
+
+    return frame_obj
+
+
+# 列式帧存储：每类actor一个结构化数组，通过 offsets 按帧索引
+ACTOR_CLASSES = ['ego', 'vehicle', 'traffic_light', 'traffic_sign', 'pedestrian']
+ACTOR_LIST_KEYS = {
+    'ego': 'ego_obj_list',
+    'vehicle': 'vehicle_obj_list',
+    'traffic_light': 'traffic_light_obj_list',
+    'traffic_sign': 'traffic_sign_obj_list',
+    'pedestrian': 'pedestrian_obj_list',
+}
+TRAFFIC_LIGHT_STATES = ['Red', 'Yellow', 'Green', 'Off', 'Unknown']
+TRAFFIC_LIGHT_STATE_CODES = {state: code for code, state in enumerate(TRAFFIC_LIGHT_STATES)}
+BICYCLE_TYPE_ID = "vehicle.bh.crossbike"
+LOCATION_PATTERN = re.compile(r"Location\(x=(-?\d+\.\d+), y=(-?\d+\.\d+), z=(-?\d+\.\d+)\)")
+VECTOR3D_PATTERN = re.compile(r"Vector3D\(x=(-?\d+\.\d+), y=(-?\d+\.\d+), z=(-?\d+\.\d+)\)")
+NAN_VECTOR3D = (np.nan, np.nan, np.nan)
+
+ACTOR_DTYPE = np.dtype([
+    ('frame', np.int32),
+    ('id', np.int64),
+    ('type_code', np.int32),
+    ('role', np.int32),
+    ('location', np.float64, (3,)),
+    ('velocity', np.float64, (3,)),
+    ('forward', np.float64, (3,)),
+    ('velocity_value', np.float64),
+    ('steering_angle', np.float64),
+    ('traffic_light_state', np.int8),
+    ('is_walker_on_road', np.bool_),
+    ('ego_distance', np.float64),
+])
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+def parse_vector3d(value):
+    if value:
+        match = VECTOR3D_PATTERN.match(value)
         if match:
-            # 提取属性名和值
-            key, value = match.group(2), match.group(3)
+            return float(match.group(1)), float(match.group(2)), float(match.group(3))
+    return NAN_VECTOR3D
+
+
+def get_code(value, vocab, codes):
+    # 把字符串映射成整数编码，None 记为 -1
+    if value is None:
+        return -1
+    code = codes.get(value)
+    if code is None:
+        code = len(vocab)
+        vocab.append(value)
+        codes[value] = code
+    return code
+
+
+def build_actor_row(obj, frame_index, type_ids, type_codes, role_names, role_codes):
+    loc = obj.get('location3d')
+    if loc:
+        location = (loc['x'], loc['y'], loc['z'])
+    else:
+        location = NAN_VECTOR3D
+    type_id = obj.get('type_id', obj.get('vehicle_type'))
+    return (frame_index,
+            parse_int(obj.get('vehicle_id', obj.get('id'))),
+            get_code(type_id, type_ids, type_codes),
+            get_code(obj.get('role_name'), role_names, role_codes),
+            location,
+            parse_vector3d(obj.get('vehicle_velocity')),
+            parse_vector3d(obj.get('forward_vector')),
+            parse_float(obj.get('vehicle_velocity_value')),
+            parse_float(obj.get('vehicle_steering_angle')),
+            TRAFFIC_LIGHT_STATE_CODES.get(obj.get('traffic_light_state'), -1),
+            obj.get('is_walker_on_road') == 'True',
+            np.nan)
+
+
+def build_frame_store(frame_objs, profiler=None):
+    # frame_objs 可以是 build_frame_obj_list 的结果，也可以是 open_log_stream 返回的生成器
+    # 逐帧转换成结构化数组，转换完的帧字典即可释放
+    type_ids, type_codes = [], {}
+    role_names, role_codes = [], {}
+    chunks = {actor_class: [] for actor_class in ACTOR_CLASSES}
+    counts = {actor_class: [] for actor_class in ACTOR_CLASSES}
+    times = []
+    for frame_index, frame_obj in enumerate(frame_objs):
+        with profile_stage(profiler, 'frame store'):
+            times.append(parse_float(str(frame_obj.get('time')).rstrip('s')))
+            for actor_class in ACTOR_CLASSES:
+                obj_list = frame_obj.get(ACTOR_LIST_KEYS[actor_class])
+                if actor_class == 'ego':
+                    # 每帧只保留第一个ego，缺失时补一行空数据保证按帧对齐
+                    obj_list = obj_list[:1] or [{}]
+                rows = [build_actor_row(obj, frame_index, type_ids, type_codes, role_names, role_codes)
+                        for obj in obj_list if obj or actor_class == 'ego']
+                chunks[actor_class].append(np.array(rows, dtype=ACTOR_DTYPE))
+                counts[actor_class].append(len(rows))
+        if profiler is not None:
+            profiler.mark_frame(frame_index + 1)
+
+    with profile_stage(profiler, 'frame store'):
+        frame_count = len(times)
+        frame_store = {
+            'frame_count': frame_count,
+            'time': np.array(times, dtype=np.float64),
+            'type_ids': type_ids,
+            'role_names': role_names,
+            'offsets': {},
+        }
+        for actor_class in ACTOR_CLASSES:
+            if chunks[actor_class]:
+                frame_store[actor_class] = np.concatenate(chunks[actor_class])
+            else:
+                frame_store[actor_class] = np.zeros(0, dtype=ACTOR_DTYPE)
+            offsets = np.zeros(frame_count + 1, dtype=np.int64)
+            np.cumsum(counts[actor_class], out=offsets[1:])
+            frame_store['offsets'][actor_class] = offsets
+
+    # 计算与ego之间的距离
+    with profile_stage(profiler, 'distance'):
+        calc_ego_distance(frame_store)
+    return frame_store
+
+
+def get_type_code(frame_store, type_id):
+    # 日志中没有出现过的类型返回 -2，不会与任何编码相等
+    if type_id in frame_store['type_ids']:
+        return frame_store['type_ids'].index(type_id)
+    return -2
+
+
+# 解析日志行的正则表达式，模块加载时只编译一次
+LOG_LINE_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - DEBUG - (\w+): (.+)",
+                              re.UNICODE | re.MULTILINE)
+OBJ_FIELD_PATTERN = re.compile(r"(\w+_+\w+): (\S+)")
+# 跳过以get_、set_、add_、apply_开头的属性
+SKIP_KEY_PREFIXES = frozenset(['get', 'set', 'add', 'apply'])
+# 属性名 -> 小写后的字段名，需要跳过的属性对应空字符串
+obj_key_cache = {}
+# 取值种类很少、在每个actor上重复出现的字段，解析时驻留(intern)字符串，所有帧共用同一个对象
+CATEGORICAL_FIELDS = frozenset([
+    'type_id', 'vehicle_type', 'role_name', 'traffic_light_state', 'is_walker_on_road',
+    'vehicle_is_at_traffic_light', 'traffic_light',
+])
+# build_frame_store 实际用到的字段（小写），解析帧时只保留这些字段
+# attributes 是对象类型的值，其中的 role_name 会被展开成单独的字段
+FRAME_STORE_FIELDS = frozenset([
+    'time', 'vehicle_id', 'id', 'type_id', 'vehicle_type', 'attributes', 'role_name',
+    'vehicle_location', 'location', 'vehicle_velocity', 'forward_vector', 'vehicle_velocity_value',
+    'vehicle_steering_angle', 'traffic_light_state', 'is_walker_on_road',
+])
+# 字段集合 -> {属性名: 字段名}，不在字段集合中的属性对应空字符串，None 表示保留全部字段
+projection_key_caches = {None: obj_key_cache}
+
+
+def tokenize_log_lines(v_msg):
+    # 一次扫描整段日志，返回 [(时间戳, 属性名, 值), ...]
+    return LOG_LINE_PATTERN.findall(v_msg.strip())
+
+
+def get_key_cache(projection=None):
+    key_cache = projection_key_caches.get(projection)
+    if key_cache is None:
+        key_cache = projection_key_caches[projection] = {}
+    return key_cache
+
+
+def get_obj_key(key, projection=None):
+    # 每个属性名只计算一次并写入缓存，之后每行只有一次字典查找；需要跳过的属性返回空字符串
+    prefix, sep, _ = key.partition('_')
+    if sep and prefix in SKIP_KEY_PREFIXES:
+        obj_key = ''
+    else:
+        obj_key = key.lower()
+        if projection is not None and obj_key not in projection:
+            obj_key = ''
+    get_key_cache(projection)[key] = obj_key
+    return obj_key
 
-            # 跳过以get_或set_开头的属性
-            if key.startswith("get_") or key.startswith("set_") or key.startswith("add_") or key.startswith("apply_"):
-                continue
 
-            # 如果值是一个对象
-            if value.startswith("{") and value.endswith('}'):
-                val = value.replace("'", "")
-                val = val.strip('{}')
-                matches = re.findall(subpattern, val)
-                for k, v in matches:
-                    obj[k] = v
-            else:
-                obj[key.lower()] = value
+def msg2obj(v_msg, projection=None):
+    # 结果字典
+    obj = {}
+    key_cache = get_key_cache(projection)
+    for _, key, value in tokenize_log_lines(v_msg):
+        obj_key = key_cache.get(key)
+        if obj_key is None:
+            obj_key = get_obj_key(key, projection)
+        if not obj_key:
+            continue
+
+        # 如果值是一个对象
+        if value[0] == '{' and value[-1] == '}':
+            val = value.replace("'", "").strip('{}')
+            for k, v in OBJ_FIELD_PATTERN.findall(val):
+                if projection is None or k in projection:
+                    obj[sys.intern(k)] = sys.intern(v)
+        elif obj_key in CATEGORICAL_FIELDS:
+            obj[obj_key] = sys.intern(value)
+        else:
+            obj[obj_key] = value
     return obj
 
 
-def create_scene_vecs(frame_obj_list, map):
-    has_crosswalk = []
-    has_intersection = []
-    has_stop_sign = []
-
-    signal_color_vec = []
-    signal_type_vec = []
-    subsignal_type_vec = []
-    for frame_obj in frame_obj_list:
-        ego_obj = frame_obj.get('ego_obj_list')[0]
-        traffic_light_obj_list = frame_obj.get('traffic_light_obj_list')
-
-
-        # Red
-        # Yellow
-        # Green
-        # Off
-        # Unknown
-        traffic_light_state = ego_obj.get('traffic_light_state')
-        if traffic_light_state == 'Red':
-            signal_color_vec.append([1, 0, 0, 0, 0])
-        elif traffic_light_state == 'Yellow':
-            signal_color_vec.append([0, 1, 0, 0, 0])
-        elif traffic_light_state == 'Green':
-            signal_color_vec.append([0, 0, 1, 0, 0])
-        elif traffic_light_state == 'Off':
-            signal_color_vec.append([0, 0, 0, 1, 0])
-        elif traffic_light_state == 'Unknown':
-            signal_color_vec.append([0, 0, 0, 0, 1])
-
-        signal_type_vec.append([0])
-        subsignal_type_vec.append([0])
-
-        ego_loc = ego_obj.get('location3d')
-        has_crosswalk.append(near_crosswalk(ego_loc, map))
-        has_intersection.append(near_junction(ego_loc, traffic_light_obj_list))
-        has_stop_sign.append(0)
-
-    signal_color_vec = np.vstack(signal_color_vec)
-    signal_type_vec = np.vstack(signal_type_vec)
-    subsignal_type_vec = np.vstack(subsignal_type_vec)
-    has_crosswalk_vec = np.array(has_crosswalk).reshape(-1, 1)
-    has_stop_sign_vec = np.array(has_stop_sign).reshape(-1, 1)
-    has_intersection_vec = np.array(has_intersection).reshape(-1, 1)
+def create_scene_vecs(frame_store, map):
+    frame_count = frame_store['frame_count']
+    ego = frame_store['ego']
+    spatial_index = get_spatial_index(map, frame_store)
+
+    # Red
+    # Yellow
+    # Green
+    # Off
+    # Unknown
+    traffic_light_state = ego['traffic_light_state'].astype(np.int64)
+    has_state = traffic_light_state >= 0
+    signal_color_vec = np.zeros((frame_count, len(TRAFFIC_LIGHT_STATES)), dtype=int)
+    signal_color_vec[np.nonzero(has_state)[0], traffic_light_state[has_state]] = 1
+
+    signal_type_vec = np.zeros((frame_count, 1), dtype=int)
+    subsignal_type_vec = np.zeros((frame_count, 1), dtype=int)
+
+    has_crosswalk_vec = near_crosswalk(ego['location'], spatial_index).reshape(-1, 1)
+    has_stop_sign_vec = np.zeros((frame_count, 1), dtype=int)
+    has_intersection_vec = near_junction(ego['location'], spatial_index).reshape(-1, 1)
     scene_vec = np.hstack([signal_color_vec, signal_type_vec, subsignal_type_vec, has_crosswalk_vec,
                            has_stop_sign_vec, has_intersection_vec])
     return scene_vec.tolist()
 
 
-def near_crosswalk(ego_loc, map):
-    crosswalks = map['crosswalks']
-    closet_dis = 999999
-    ego_x = ego_loc.get('x')
-    ego_y = ego_loc.get('y')
-    for crosswalk in crosswalks:
-        dis = calc_dis(ego_x, ego_y, crosswalk.get('x'), crosswalk.get('y'))
-        if dis < closet_dis:
-            closet_dis = dis
-    if closet_dis <= 3:
-        return 1
-    else:
-        return 0
-
-
-# 计算两个二维点之间的距离
-def calc_dis(x0, y0, x1, y1):
-    return math.sqrt((float(x1)-float(x0))**2 + (float(y1)-float(y0))**2)
-
-
-def near_junction_old(ego_loc, map):
-    if "junctions" in map:
-        junctions = map['junctions']
-        ego_x = ego_loc.get('x')
-        closet_dis = 999999
-        ego_y = ego_loc.get('y')
-        for junction in junctions:
-            dis = calc_dis(ego_x, ego_y, junction.get('x'), junction.get('y'))
-            if dis < closet_dis:
-                closet_dis = dis
-        if closet_dis <= 3:
-            return 1
-        else:
-            return 0
-    else:
-        return 0
-
-
-def near_junction(ego_loc, traffic_light_obj_list):
-    if traffic_light_obj_list:
-        ego_x = ego_loc.get('x')
-        closet_dis = 999999
-        ego_y = ego_loc.get('y')
-        for traffic_light_obj in traffic_light_obj_list:
-            location3d = traffic_light_obj.get("location3d")
-            dis = calc_dis(ego_x, ego_y, location3d.get('x'), location3d.get('y'))
-            if dis < closet_dis:
-                closet_dis = dis
-        if closet_dis <= 3:
-            return 1
-        else:
-            return 0
-    else:
-        return 0
-
-
-def on_crosswalk(loc, map, on_distance=1.0):
-    if loc is None:
-        return 0
-    crosswalks = map['crosswalks']
-    x = loc.get('x')
-    y = loc.get('y')
-    closet_dis = 999999
-    for crosswalk in crosswalks:
-        dis = calc_dis(x, y, crosswalk.get('x'), crosswalk.get('y'))
-        if dis < closet_dis:
-            closet_dis = dis
-    if closet_dis <= on_distance:
-        return 1
-    else:
-        return 0
-
-
-def calc_angle_2d(v1, v2):
-    x1 = v1['x']
-    y1 = v1['y']
-    x2 = v2['x']
-    y2 = v2['y']
-
-    dot_product = x1 * x2 + y1 * y2
-    # 计算两个向量的模长
-    magnitude_vec1 = math.sqrt(x1 ** 2 + y1 ** 2)
-    magnitude_vec2 = math.sqrt(x2 ** 2 + y2 ** 2)
-    # 计算cosθ
-    cos_theta = dot_product / (magnitude_vec1 * magnitude_vec2)
-    # 确保cosθ的值在有效范围内，避免数学域错误
-    cos_theta = max(min(cos_theta, 1), -1)
-
-    # 计算并返回角度θ，转换为度
-    angle_rad = math.acos(cos_theta)
-    angle_deg = math.degrees(angle_rad)
-    return angle_deg
-
-
-def create_actor_vecs(frame_obj_list,  map, near_distance=5.0):
-    has_vehicle = []
-    has_bicycle = []
-    has_pedestrian = []
-    has_other = []
-    has_on_road_person = []
-    has_on_crosswalk_person = []
-    has_opposing_direction_vehicle = []
-    has_crossing_direction_vehicle = []
-
-    for frame_obj in frame_obj_list:
-        ego_obj = frame_obj.get('ego_obj_list')[0]
-        deal_vector3d(ego_obj, "forward_vector", "forward_vector_3d")
-
-        near_pedestrian_count = 0
-        on_road_pedestrian_count = 0
-        on_crosswalk_pedestrian_count = 0
-
-        pedestrian_obj_list = frame_obj.get('pedestrian_obj_list')
-        for pedestrian_obj in pedestrian_obj_list:
-            if pedestrian_obj.get("ego_distance") is not None:
-                ego_distance = float(pedestrian_obj.get("ego_distance"))
-                if ego_distance < near_distance:
-                    near_pedestrian_count += 1
-                    if pedestrian_obj.get("is_walker_on_road") is not None and pedestrian_obj.get("is_walker_on_road"):
-                        on_road_pedestrian_count += 1
-                    if on_crosswalk(pedestrian_obj.get("location"), map) == 1:
-                        on_crosswalk_pedestrian_count += 1
-
-        near_vehicle_count = 0
-        near_bicycle_count = 0
-        opposing_direction_count = 0
-        crossing_direction_count = 0
-
-        vehicle_obj_list = frame_obj.get('vehicle_obj_list')
-        for vehicle_obj in vehicle_obj_list:
-            if vehicle_obj.get("ego_distance") is not None:
-                ego_distance = float(vehicle_obj.get("ego_distance"))
-                if ego_distance < near_distance:
-                    type_id = vehicle_obj.get('type_id')
-                    if type_id == "vehicle.bh.crossbike": # bicycle
-                        near_bicycle_count += 1
-                    else:
-                        near_vehicle_count += 1
-
-                    deal_vector3d(vehicle_obj, "forward_vector", "forward_vector_3d")
-                    ego_angle = calc_angle_2d(ego_obj.get("forward_vector_3d"), vehicle_obj.get("forward_vector_3d"))
-                    if 135 > ego_angle > 45:
-                        crossing_direction_count += 1
-                    elif ego_angle >= 135:
-                        opposing_direction_count += 1
-
-        if near_vehicle_count > 0:
-            has_vehicle.append(1)
-        else:
-            has_vehicle.append(0)
+# 均匀网格空间索引，网格编号 (ix, iy) 编码成一个 int64 排序后用 searchsorted 查找
+GRID_KEY_OFFSET = 1 << 20
+GRID_KEY_BASE = 1 << 21
 
-        if near_bicycle_count > 0:
-            has_bicycle.append(1)
-        else:
-            has_bicycle.append(0)
 
-        if near_pedestrian_count > 0:
-            has_pedestrian.append(1)
-        else:
-            has_pedestrian.append(0)
+def grid_keys(cell_x, cell_y):
+    return (cell_x + GRID_KEY_OFFSET) * GRID_KEY_BASE + (cell_y + GRID_KEY_OFFSET)
 
-        has_other.append(0)
 
-        if on_road_pedestrian_count > 0:
-            has_on_road_person.append(1)
-        else:
-            has_on_road_person.append(0)
+def build_spatial_index(points, cell_size=5.0):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    points = points[~np.isnan(points).any(axis=1)]
+    cells = np.floor(points / cell_size).astype(np.int64)
+    keys = grid_keys(cells[:, 0], cells[:, 1])
+    order = np.argsort(keys, kind='stable')
+    return {
+        'cell_size': cell_size,
+        'points': points[order],
+        'keys': keys[order],
+    }
 
-        if on_crosswalk_pedestrian_count > 0:
-            has_on_crosswalk_person.append(1)
-        else:
-            has_on_crosswalk_person.append(0)
 
-        if opposing_direction_count > 0:
-            has_opposing_direction_vehicle.append(1)
+def query_radius(spatial_index, locs, radius):
+    # 批量半径查询：返回每个点 radius 范围内（含边界）是否存在索引点
+    locs = np.atleast_2d(np.asarray(locs, dtype=np.float64))
+    found = np.zeros(len(locs), dtype=bool)
+    points = spatial_index['points']
+    keys = spatial_index['keys']
+    cell_size = spatial_index['cell_size']
+    if len(points) == 0 or len(locs) == 0:
+        return found
+
+    xy = locs[:, :2]
+    # 坐标缺失的点视为不在范围内
+    pending = np.nonzero(~np.isnan(xy).any(axis=1))[0]
+    cells = np.floor(xy[pending] / cell_size).astype(np.int64)
+    reach = int(np.ceil(radius / cell_size))
+    for dx in range(-reach, reach + 1):
+        for dy in range(-reach, reach + 1):
+            if len(pending) == 0:
+                return found
+            cell_keys = grid_keys(cells[:, 0] + dx, cells[:, 1] + dy)
+            start = np.searchsorted(keys, cell_keys, side='left')
+            counts = np.searchsorted(keys, cell_keys, side='right') - start
+            total = counts.sum()
+            if total == 0:
+                continue
+            # 把每个查询点展开成 (查询点, 候选点) 对
+            query = np.repeat(np.arange(len(pending)), counts)
+            candidate = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+            query_xy = xy[pending[query]]
+            dis = np.sqrt((points[candidate, 0] - query_xy[:, 0]) ** 2 + (points[candidate, 1] - query_xy[:, 1]) ** 2)
+            hit = np.zeros(len(pending), dtype=bool)
+            hit[query[dis <= radius]] = True
+            found[pending[hit]] = True
+            pending = pending[~hit]
+            cells = cells[~hit]
+    return found
+
+
+def junction_location(junction):
+    match = LOCATION_PATTERN.search(junction.get('transform', ''))
+    if match:
+        return float(match.group(1)), float(match.group(2))
+    return np.nan, np.nan
+
+
+def get_spatial_index(map, frame_store):
+    # 每个地图只构建一次，缓存在 map['spatial_index'] 中
+    spatial_index = map.get('spatial_index')
+    if spatial_index is None:
+        geometry = map.get('map_geometry')
+        if geometry is not None:
+            crosswalk_points = geometry['crosswalks'][:, :2]
+            junction_points = geometry['junctions'][:, :2]
+            traffic_light_points = geometry['traffic_lights'][:, :2]
         else:
-            has_opposing_direction_vehicle.append(0)
+            crosswalk_points = [(parse_float(crosswalk.get('x')), parse_float(crosswalk.get('y')))
+                                for crosswalk in map['crosswalks']]
+            junction_points = [junction_location(junction) for junction in map.get('junctions', [])]
+            # 信号灯是静态的，去重后建索引
+            traffic_light_points = np.unique(frame_store['traffic_light']['location'][:, :2], axis=0)
+        spatial_index = {
+            'crosswalks': build_spatial_index(crosswalk_points),
+            'junctions': build_spatial_index(junction_points),
+            'traffic_lights': build_spatial_index(traffic_light_points),
+        }
+        map['spatial_index'] = spatial_index
+    return spatial_index
+
+
+def near_crosswalk(ego_locs, spatial_index):
+    return query_radius(spatial_index['crosswalks'], ego_locs, 3).astype(int)
+
+
+def near_junction_old(ego_locs, spatial_index):
+    return query_radius(spatial_index['junctions'], ego_locs, 3).astype(int)
+
+
+def near_junction(ego_locs, spatial_index):
+    return query_radius(spatial_index['traffic_lights'], ego_locs, 3).astype(int)
+
+
+def on_crosswalk(locs, spatial_index, on_distance=1.0):
+    return query_radius(spatial_index['crosswalks'], locs, on_distance).astype(int)
+
+
+def calc_angle_2d_array(v1, v2):
+    # 计算二维夹角，v1、v2 为 (n, 2) 或 (n, 3)，返回角度（度）
+    # 模长为0或坐标缺失时结果为 nan，不会被归为任何方向
+    dot_product = v1[:, 0] * v2[:, 0] + v1[:, 1] * v2[:, 1]
+    magnitude_vec1 = np.sqrt(v1[:, 0] ** 2 + v1[:, 1] ** 2)
+    magnitude_vec2 = np.sqrt(v2[:, 0] ** 2 + v2[:, 1] ** 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_theta = dot_product / (magnitude_vec1 * magnitude_vec2)
+        cos_theta = np.where(np.isfinite(cos_theta), np.clip(cos_theta, -1, 1), np.nan)
+        return np.degrees(np.arccos(cos_theta))
+
+
+def create_actor_vecs(frame_store,  map, near_distance=5.0):
+    return create_actor_vecs_multi(frame_store, map, [near_distance])[near_distance]
+
+
+def create_actor_vecs_multi(frame_store, map, near_distances):
+    # 一次计算多个半径的 actor_vec，返回 {半径: 向量}
+    # 距离、夹角、人行横道查询都只计算一次，之后按距离分桶计数
+    frame_count = frame_store['frame_count']
+    radius_count = len(near_distances)
+    ego_forward = frame_store['ego']['forward']
+
+    def count_by_radius(frame_index, buckets):
+        return count_frames_by_radius(frame_index.astype(np.int64), buckets, frame_count, radius_count)
+
+    pedestrians = frame_store['pedestrian']
+    buckets = radius_buckets(pedestrians['ego_distance'], near_distances)
+    near = buckets < radius_count
+    near_frames = pedestrians['frame'][near]
+    buckets = buckets[near]
+    on_road = pedestrians['is_walker_on_road'][near]
+    on_crosswalk_flags = on_crosswalk(pedestrians['location'][near], get_spatial_index(map, frame_store)) == 1
+    near_pedestrian_count = count_by_radius(near_frames, buckets)
+    on_road_pedestrian_count = count_by_radius(near_frames[on_road], buckets[on_road])
+    on_crosswalk_pedestrian_count = count_by_radius(near_frames[on_crosswalk_flags], buckets[on_crosswalk_flags])
+
+    vehicles = frame_store['vehicle']
+    buckets = radius_buckets(vehicles['ego_distance'], near_distances)
+    near = buckets < radius_count
+    is_bicycle = vehicles['type_code'] == get_type_code(frame_store, BICYCLE_TYPE_ID)
+    near_bicycle_count = count_by_radius(vehicles['frame'][near & is_bicycle], buckets[near & is_bicycle])
+    near_vehicle_count = count_by_radius(vehicles['frame'][near & ~is_bicycle], buckets[near & ~is_bicycle])
+
+    # 一次计算所有车辆与所在帧ego前进方向的夹角
+    ego_angle = calc_angle_2d_array(ego_forward[vehicles['frame']], vehicles['forward'])
+    crossing = near & (135 > ego_angle) & (ego_angle > 45)
+    opposing = near & (ego_angle >= 135)
+    crossing_direction_count = count_by_radius(vehicles['frame'][crossing], buckets[crossing])
+    opposing_direction_count = count_by_radius(vehicles['frame'][opposing], buckets[opposing])
+
+    has_other = np.zeros(frame_count, dtype=int)
+
+    actor_vecs = {}
+    for near_distance, column in zip(near_distances, radius_columns(near_distances)):
+        actor_vec = np.column_stack([near_vehicle_count[:, column] > 0, near_bicycle_count[:, column] > 0,
+                                     near_pedestrian_count[:, column] > 0, has_other,
+                                     on_road_pedestrian_count[:, column] > 0,
+                                     on_crosswalk_pedestrian_count[:, column] > 0,
+                                     opposing_direction_count[:, column] > 0,
+                                     crossing_direction_count[:, column] > 0]).astype(int)
+        actor_vecs[near_distance] = actor_vec.tolist()
+    return actor_vecs
 
-        if crossing_direction_count > 0:
-            has_crossing_direction_vehicle.append(1)
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='把采集日志转换成场景向量')
+    argparser.add_argument('logs', nargs='?', default=None,
+                           help='日志目录或 glob 模式，不指定时只处理 data/myapp6.1.log')
+    argparser.add_argument('--output', default=os.path.join('data', 'vecs'), help='向量文件输出目录')
+    argparser.add_argument('--workers', default=None, type=int, help='进程数，默认等于CPU核数')
+    argparser.add_argument('--profile', default=None,
+                           help='单个日志模式下输出分阶段耗时/内存统计的json文件路径（不使用解析缓存）')
+    argparser.add_argument('--follow', action='store_true',
+                           help='跟随正在采集的日志实时生成向量，logs 为单个日志文件路径')
+    argparser.add_argument('--idle-timeout', default=None, type=float,
+                           help='--follow 模式下多少秒没有新数据就结束，默认一直等待')
+    argparser.add_argument('--query', default=None,
+                           help='在 --output 目录的分段索引中查询，逗号分隔的列名，列名=0 表示该列为0，'
+                                '例如 turn_left,red,crossing_vehicle')
+    argparser.add_argument('--similar', default=None,
+                           help='在 --output 目录的分段索引中检索与 日志名:行号 最相似的行（汉明距离）')
+    argparser.add_argument('--top-k', default=10, type=int, help='--similar 返回的结果数')
+    args = argparser.parse_args()
+    if args.similar:
+        segment_index = load_segment_index(os.path.join(args.output, SEGMENT_INDEX_NAME))
+        log, _, frame = args.similar.rpartition(':')
+        query_code = get_frame_code(segment_index, log, int(frame))
+        print(f"query: {' '.join(decode_segment_code(query_code))}")
+        for log, frame, distance in search_similar_frames(segment_index, query_code, args.top_k):
+            print(f"{log} {frame} distance: {distance}")
+    elif args.query:
+        conditions = {}
+        for item in args.query.split(','):
+            column, _, flag = item.partition('=')
+            conditions[column.strip()] = int(flag or 1)
+        segment_index = load_segment_index(os.path.join(args.output, SEGMENT_INDEX_NAME))
+        for log, start, end in query_segments(segment_index, **conditions):
+            print(f"{log} {start}-{end}")
+    elif args.follow:
+        live_record2vec(args.logs or LOG_FILE_PATH, idle_timeout=args.idle_timeout, on_frame=print_live_frame)
+    elif args.logs is None:
+        if args.profile:
+            profiler = StageProfiler()
+            record2vec(use_cache=False, profiler=profiler)
+            print(profiler.summary_table())
+            profiler.save_trace(args.profile)
         else:
-            has_crossing_direction_vehicle.append(0)
-
-    if len(has_vehicle) != 0:
-        has_vehicle = np.vstack(has_vehicle)
-        has_bicycle = np.vstack(has_bicycle)
-        has_pedestrian = np.vstack(has_pedestrian)
-        has_other = np.vstack(has_other)
-        has_on_road_person = np.vstack(has_on_road_person)
-        has_on_crosswalk_person = np.vstack(has_on_crosswalk_person)
-        has_opposing_direction_vehicle = np.vstack(has_opposing_direction_vehicle)
-        has_crossing_direction_vehicle = np.vstack(has_crossing_direction_vehicle)
-
-        actor_vec = np.hstack([has_vehicle, has_bicycle, has_pedestrian, has_other,
-                               has_on_road_person, has_on_crosswalk_person,
-                               has_opposing_direction_vehicle, has_crossing_direction_vehicle])
+            record2vec()
     else:
-        actor_vec = np.zeros((len(frame_obj_list), 8))
-
-    return actor_vec.tolist()
-
-if __name__ == '__main__':
-    record2vec()
+        batch_record2vec(args.logs, args.output, args.workers)
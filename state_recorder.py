@@ -0,0 +1,363 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+# 二进制状态记录：代替逐个actor的 inspect.getmembers 文本日志
+# 文件结构：
+#   文件头  RECORD_MAGIC + uint32 版本号 + uint32 json长度 + json（地图信息、各类actor的记录格式）
+#   每一帧  FRAME_HEADER_DTYPE（时间、新字符串数量、各类actor数量）
+#           + 新出现的字符串（uint16 长度 + utf-8），编码为其在全部字符串中的序号
+#           + 按 RECORD_CLASSES 顺序的各类actor记录：
+#             关键帧（MODE_FULL）为 RECORD_DTYPES 的原始字节；
+#             差分帧（MODE_DELTA）只写与上一帧相比变化的字段，每个字段为
+#             uint32 变化行数 n + n 个 uint32 行号 + n 个该字段的值
+# 只有 DELTA_CLASSES（信号灯、交通标识）使用差分帧，每 keyframe_interval 帧写一次完整的关键帧；
+# actor 集合或顺序与上一帧不同时该类当帧也写完整记录
+# 每帧写完立即 flush，采集中断时最后一个不完整的帧会被读取端丢弃
+RECORD_MAGIC = b'CARLAREC'
+RECORD_VERSION = 2
+RECORD_SUFFIX = '.rec'
+RECORD_CLASSES = ['vehicle', 'traffic_light', 'traffic_sign', 'pedestrian']
+DELTA_CLASSES = ['traffic_light', 'traffic_sign']
+KEYFRAME_INTERVAL = 100
+MODE_FULL = 0
+MODE_DELTA = 1
+TRAFFIC_LIGHT_STATES = ['Red', 'Yellow', 'Green', 'Off', 'Unknown']
+TRAFFIC_LIGHT_STATE_CODES = {state: code for code, state in enumerate(TRAFFIC_LIGHT_STATES)}
+
+# transform: x, y, z, pitch, yaw, roll
+RECORD_DTYPES = {
+    'vehicle': np.dtype([
+        ('id', np.int64),
+        ('type_code', np.int32),
+        ('role', np.int32),
+        ('transform', np.float32, (6,)),
+        ('velocity', np.float32, (3,)),
+        ('acceleration', np.float32, (3,)),
+        ('angular_velocity', np.float32, (3,)),
+        # throttle, steer, brake
+        ('control', np.float32, (3,)),
+        ('speed_limit', np.float32),
+        ('traffic_light_state', np.int8),
+        ('is_at_traffic_light', np.bool_),
+    ]),
+    'traffic_light': np.dtype([
+        ('id', np.int64),
+        ('type_code', np.int32),
+        ('transform', np.float32, (6,)),
+        ('traffic_light_state', np.int8),
+    ]),
+    'traffic_sign': np.dtype([
+        ('id', np.int64),
+        ('type_code', np.int32),
+        ('transform', np.float32, (6,)),
+    ]),
+    'pedestrian': np.dtype([
+        ('id', np.int64),
+        ('type_code', np.int32),
+        ('transform', np.float32, (6,)),
+        ('velocity', np.float32, (3,)),
+        ('is_walker_on_road', np.bool_),
+    ]),
+}
+FRAME_HEADER_DTYPE = np.dtype([
+    ('time', np.float64),
+    ('new_strings', np.uint32),
+    ('counts', np.uint32, (len(RECORD_CLASSES),)),
+    ('modes', np.uint8, (len(RECORD_CLASSES),)),
+])
+# 版本1的帧头没有 modes，所有帧都是完整记录
+FRAME_HEADER_DTYPES = {
+    1: np.dtype([
+        ('time', np.float64),
+        ('new_strings', np.uint32),
+        ('counts', np.uint32, (len(RECORD_CLASSES),)),
+    ]),
+    RECORD_VERSION: FRAME_HEADER_DTYPE,
+}
+FILE_HEADER = struct.Struct('<8sII')
+STRING_LENGTH = struct.Struct('<H')
+DELTA_COUNT = struct.Struct('<I')
+
+
+def is_state_record(file_path):
+    return file_path.endswith(RECORD_SUFFIX)
+
+
+def dtype_to_json(dtype):
+    return [[name, dtype[name].base.str, list(dtype[name].shape)] for name in dtype.names]
+
+
+def dtype_from_json(fields):
+    return np.dtype([(name, base, tuple(shape)) for name, base, shape in fields])
+
+
+def transform_values(transform):
+    location = transform.location
+    rotation = transform.rotation
+    return location.x, location.y, location.z, rotation.pitch, rotation.yaw, rotation.roll
+
+
+def vector_values(vector):
+    return vector.x, vector.y, vector.z
+
+
+def changed_rows(rows, previous_rows, name):
+    # 按字节比较，NaN 不会被当成每帧都变化
+    count = len(rows)
+    current = np.ascontiguousarray(rows[name]).view(np.uint8).reshape(count, -1)
+    previous = np.ascontiguousarray(previous_rows[name]).view(np.uint8).reshape(count, -1)
+    return np.flatnonzero((current != previous).any(axis=1))
+
+
+def encode_delta(rows, previous_rows):
+    # 调用前已确认两帧的 actor id 顺序一致，id 字段不写
+    chunks = []
+    for name in rows.dtype.names[1:]:
+        indices = changed_rows(rows, previous_rows, name)
+        chunks.append(DELTA_COUNT.pack(len(indices)))
+        if len(indices):
+            chunks.append(indices.astype(np.uint32).tobytes())
+            chunks.append(np.ascontiguousarray(rows[name][indices]).tobytes())
+    return b''.join(chunks)
+
+
+def kinematic_source(actor, snapshot):
+    # 运动状态优先从本帧的 world.get_snapshot() 中读取（一次请求得到所有actor）
+    # 快照中没有该actor（例如刚生成）时退回到逐个actor调用
+    if snapshot is not None:
+        actor_snapshot = snapshot.find(actor.id)
+        if actor_snapshot is not None:
+            return actor_snapshot
+    return actor
+
+
+class StateRecorder:
+    def __init__(self, file_path, map_info, keyframe_interval=KEYFRAME_INTERVAL):
+        # map_info 为写入文件头的地图信息，例如 {'name': ..., 'map_geometry_cache': ...}
+        # keyframe_interval 为完整关键帧的间隔帧数，1 表示每帧都写完整记录
+        self.file = open(file_path, 'wb')
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.frame_count = 0
+        self.previous_rows = {}
+        self.string_codes = {}
+        self.new_strings = []
+        # 静态信息按 actor id 缓存：车辆/行人的类型和 role_name，信号灯的位置，交通标识的整行记录
+        self.static_codes = {}
+        self.static_transforms = {}
+        self.static_rows = {}
+        header = json.dumps({
+            'map': map_info,
+            'classes': RECORD_CLASSES,
+            'delta_classes': DELTA_CLASSES,
+            'keyframe_interval': self.keyframe_interval,
+            'schemas': {actor_class: dtype_to_json(RECORD_DTYPES[actor_class]) for actor_class in RECORD_CLASSES},
+        }, ensure_ascii=False).encode('utf-8')
+        self.file.write(FILE_HEADER.pack(RECORD_MAGIC, RECORD_VERSION, len(header)))
+        self.file.write(header)
+        self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def get_code(self, value):
+        # 字符串第一次出现时分配编码，随当前帧一起写入文件
+        if value is None:
+            return -1
+        code = self.string_codes.get(value)
+        if code is None:
+            code = len(self.string_codes)
+            self.string_codes[value] = code
+            self.new_strings.append(value)
+        return code
+
+    def actor_codes(self, actor):
+        codes = self.static_codes.get(actor.id)
+        if codes is None:
+            codes = (self.get_code(actor.type_id), self.get_code(actor.attributes.get('role_name')))
+            self.static_codes[actor.id] = codes
+        return codes
+
+    def vehicle_row(self, vehicle, snapshot=None):
+        # 快照中没有的控制量、信号灯状态、限速仍然逐个车辆读取
+        source = kinematic_source(vehicle, snapshot)
+        control = vehicle.get_control()
+        type_code, role_code = self.actor_codes(vehicle)
+        return (vehicle.id,
+                type_code,
+                role_code,
+                transform_values(source.get_transform()),
+                vector_values(source.get_velocity()),
+                vector_values(source.get_acceleration()),
+                vector_values(source.get_angular_velocity()),
+                (control.throttle, control.steer, control.brake),
+                vehicle.get_speed_limit(),
+                TRAFFIC_LIGHT_STATE_CODES.get(str(vehicle.get_traffic_light_state()), -1),
+                vehicle.is_at_traffic_light())
+
+    def traffic_light_row(self, traffic_light):
+        # 信号灯位置不变，只在第一次出现时读取
+        transform = self.static_transforms.get(traffic_light.id)
+        if transform is None:
+            transform = transform_values(traffic_light.get_transform())
+            self.static_transforms[traffic_light.id] = transform
+        return (traffic_light.id,
+                self.actor_codes(traffic_light)[0],
+                transform,
+                TRAFFIC_LIGHT_STATE_CODES.get(str(traffic_light.get_state()), -1))
+
+    def traffic_sign_row(self, traffic_sign):
+        # 交通标识完全静态，整行缓存
+        row = self.static_rows.get(traffic_sign.id)
+        if row is None:
+            row = (traffic_sign.id,
+                   self.actor_codes(traffic_sign)[0],
+                   transform_values(traffic_sign.get_transform()))
+            self.static_rows[traffic_sign.id] = row
+        return row
+
+    def pedestrian_row(self, pedestrian, map_instance, snapshot=None):
+        source = kinematic_source(pedestrian, snapshot)
+        transform = source.get_transform()
+        # 与文本日志一致：能取到 Waypoint 即认为行人在道路上
+        is_walker_on_road = map_instance.get_waypoint(transform.location) is not None
+        return (pedestrian.id,
+                self.actor_codes(pedestrian)[0],
+                transform_values(transform),
+                vector_values(source.get_velocity()),
+                is_walker_on_road)
+
+    def write_frame(self, time, vehicles, traffic_lights, traffic_signs, pedestrians, map_instance, snapshot=None):
+        # snapshot 为本帧的 world.get_snapshot()，车辆和行人的运动状态从中批量读取
+        rows = {
+            'vehicle': [self.vehicle_row(vehicle, snapshot) for vehicle in vehicles],
+            'traffic_light': [self.traffic_light_row(traffic_light) for traffic_light in traffic_lights],
+            'traffic_sign': [self.traffic_sign_row(traffic_sign) for traffic_sign in traffic_signs
+                             if traffic_sign.type_id != 'traffic.traffic_light'],
+            'pedestrian': [self.pedestrian_row(pedestrian, map_instance, snapshot) for pedestrian in pedestrians],
+        }
+        is_keyframe = self.frame_count % self.keyframe_interval == 0
+        self.frame_count += 1
+        frame_header = np.zeros(1, dtype=FRAME_HEADER_DTYPE)
+        frame_header['time'] = time
+        frame_header['new_strings'] = len(self.new_strings)
+        chunks = [None]
+        for value in self.new_strings:
+            data = value.encode('utf-8')
+            chunks.append(STRING_LENGTH.pack(len(data)))
+            chunks.append(data)
+        self.new_strings = []
+        for column, actor_class in enumerate(RECORD_CLASSES):
+            class_rows = np.array(rows[actor_class], dtype=RECORD_DTYPES[actor_class])
+            frame_header['counts'][0, column] = len(class_rows)
+            if actor_class in DELTA_CLASSES:
+                previous_rows = self.previous_rows.get(actor_class)
+                self.previous_rows[actor_class] = class_rows
+                if (not is_keyframe and previous_rows is not None
+                        and np.array_equal(class_rows['id'], previous_rows['id'])):
+                    frame_header['modes'][0, column] = MODE_DELTA
+                    chunks.append(encode_delta(class_rows, previous_rows))
+                    continue
+            chunks.append(class_rows.tobytes())
+        chunks[0] = frame_header.tobytes()
+        self.file.write(b''.join(chunks))
+        self.file.flush()
+
+
+def open_state_record(file_path):
+    # 返回 (文件头, 逐帧生成器)，生成器产出 (时间, {actor类型: 记录数组}, 字符串表)
+    # 字符串表是同一个列表，随读取进度追加新出现的字符串
+    file = open(file_path, 'rb')
+    try:
+        magic, version, header_length = FILE_HEADER.unpack(file.read(FILE_HEADER.size))
+        if magic != RECORD_MAGIC or version not in FRAME_HEADER_DTYPES:
+            raise ValueError(f"不是支持的状态记录文件: {file_path}")
+        header = json.loads(file.read(header_length).decode('utf-8'))
+    except Exception:
+        file.close()
+        raise
+    header['version'] = version
+    dtypes = {actor_class: dtype_from_json(header['schemas'][actor_class]) for actor_class in header['classes']}
+    return header, iter_state_frames(file, header['classes'], dtypes, FRAME_HEADER_DTYPES[version])
+
+
+def read_delta(file, previous_rows):
+    # 在上一帧记录的副本上写入变化的字段；文件不完整时返回 None
+    rows = previous_rows.copy()
+    for name in rows.dtype.names[1:]:
+        data = file.read(DELTA_COUNT.size)
+        if len(data) < DELTA_COUNT.size:
+            return None
+        count, = DELTA_COUNT.unpack(data)
+        if not count:
+            continue
+        field_dtype = rows.dtype[name]
+        size = count * (4 + field_dtype.itemsize)
+        data = file.read(size)
+        if len(data) < size:
+            return None
+        indices = np.frombuffer(data, dtype=np.uint32, count=count)
+        rows[name][indices] = np.frombuffer(data, dtype=field_dtype.base, offset=count * 4).reshape(
+            (count,) + field_dtype.shape)
+    return rows
+
+
+def iter_state_frames(file, classes, dtypes, frame_header_dtype=FRAME_HEADER_DTYPE):
+    strings = []
+    # 差分帧需要上一帧的完整记录
+    previous_rows = {}
+    with file:
+        while True:
+            data = file.read(frame_header_dtype.itemsize)
+            if len(data) < frame_header_dtype.itemsize:
+                return
+            frame_header = np.frombuffer(data, dtype=frame_header_dtype)[0]
+            if 'modes' in frame_header_dtype.names:
+                modes = frame_header['modes']
+            else:
+                modes = [MODE_FULL] * len(classes)
+            new_strings = []
+            for _ in range(int(frame_header['new_strings'])):
+                data = file.read(STRING_LENGTH.size)
+                if len(data) < STRING_LENGTH.size:
+                    return
+                length, = STRING_LENGTH.unpack(data)
+                data = file.read(length)
+                if len(data) < length:
+                    return
+                new_strings.append(data.decode('utf-8'))
+            rows = {}
+            for actor_class, count, mode in zip(classes, frame_header['counts'], modes):
+                if mode == MODE_DELTA:
+                    class_rows = read_delta(file, previous_rows[actor_class])
+                    if class_rows is None:
+                        return
+                else:
+                    size = dtypes[actor_class].itemsize * int(count)
+                    data = file.read(size)
+                    if len(data) < size:
+                        return
+                    class_rows = np.frombuffer(data, dtype=dtypes[actor_class])
+                rows[actor_class] = class_rows
+                previous_rows[actor_class] = class_rows
+            strings += new_strings
+            yield float(frame_header['time']), rows, strings
+
+
+def forward_vectors(transforms):
+    # 与 carla.Transform.get_forward_vector 相同：由 pitch、yaw（角度）计算单位前进方向
+    pitch = np.radians(transforms[:, 3].astype(np.float64))
+    yaw = np.radians(transforms[:, 4].astype(np.float64))
+    return np.column_stack([np.cos(pitch) * np.cos(yaw), np.cos(pitch) * np.sin(yaw), np.sin(pitch)])
+
+
+def record_file_path(log_path):
+    return os.path.splitext(log_path)[0] + RECORD_SUFFIX
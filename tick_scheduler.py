@@ -0,0 +1,190 @@
+import math
+import queue
+import time
+
+# 采集脚本的固定频率调度：按 start + index * step_time 计算每一帧的时间点，不会累积误差
+# 三种模式：
+#   'wall'     按墙钟时间采样，sleep 到下一个时间点（时间已过则不 sleep）
+#   'sync'     同步模式，由采集脚本调用 world.tick() 推进仿真，每隔 step_time 的仿真时间采样一次，采样与仿真帧对齐
+#   'on_tick'  异步模式，world.on_tick 回调中按仿真时间选出需要采样的帧，交给采集循环处理
+# 一帧处理超时（overrun）时，'wall' 模式按 policy 处理：
+#   'skip'      跳过已经错过的时间点，从最近的一个时间点继续，记录跳过的帧数
+#   'catch_up'  不跳过，连续处理错过的帧直到追上
+# 'on_tick' 模式无法回到过去的仿真帧，采集循环忙时错过的帧总是记为跳过；'sync' 模式仿真等待采集，不会跳帧
+TICK_MODES = ('wall', 'sync', 'on_tick')
+OVERRUN_POLICIES = ('skip', 'catch_up')
+# 仿真时间是浮点数累加，判断是否到达时间点时留一点余量
+TIME_EPSILON = 1e-6
+# 'sync' 模式下没有设置 fixed_delta_seconds 时使用的仿真步长（20Hz）
+SYNC_DELTA_SECONDS = 0.05
+
+
+def get_sync_delta(settings, step_time):
+    # 已经设置了 fixed_delta_seconds 时保持不变；
+    # 否则使用 SYNC_DELTA_SECONDS，且不超过 step_time 和物理子步长的上限 max_substep_delta_time * max_substeps
+    if settings.fixed_delta_seconds:
+        return settings.fixed_delta_seconds
+    max_delta = getattr(settings, 'max_substep_delta_time', 0.01) * getattr(settings, 'max_substeps', 10)
+    return min(SYNC_DELTA_SECONDS, step_time, max_delta)
+
+
+class TickScheduler:
+    def __init__(self, step_time, duration=None, policy='skip', mode='wall', world=None, traffic_manager=None,
+                 want_snapshot=False, timeout=10.0, clock=time.monotonic, sleep=time.sleep):
+        # duration 为 None 时一直运行；'sync' 和 'on_tick' 模式下 duration 是仿真时间
+        # traffic_manager 为 client.get_trafficmanager()，'sync' 模式下随仿真一起切换到同步模式
+        # want_snapshot 为 True 时 'wall' 模式每帧调用一次 world.get_snapshot()；'sync'/'on_tick' 模式总是有快照
+        # timeout 为 'on_tick' 模式下等待仿真帧的最长时间（秒）
+        if mode not in TICK_MODES:
+            raise ValueError(f"mode 只能是 {TICK_MODES}: {mode}")
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError(f"policy 只能是 {OVERRUN_POLICIES}: {policy}")
+        if mode != 'wall' and world is None:
+            raise ValueError(f"'{mode}' 模式需要 world")
+        if step_time <= 0:
+            raise ValueError(f"step_time 必须大于0: {step_time}")
+        self.step_time = step_time
+        self.duration = duration
+        self.policy = policy
+        self.mode = mode
+        self.world = world
+        self.traffic_manager = traffic_manager
+        self.want_snapshot = want_snapshot
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        # 每一帧的处理时间和延迟（实际采样时间 - 计划时间，'sync'/'on_tick' 模式为仿真时间），单位秒
+        self.work_times = []
+        self.lateness = []
+        self.skipped = 0
+        self.overruns = 0
+
+    def __iter__(self):
+        # 每一帧产出 (从开始到本帧的时间, 本帧的 WorldSnapshot)；'wall' 模式下不需要快照时为 None
+        if self.mode == 'sync':
+            return self.sync_ticks()
+        if self.mode == 'on_tick':
+            return self.on_tick_ticks()
+        return self.wall_ticks()
+
+    def in_duration(self, elapsed):
+        return self.duration is None or elapsed < self.duration - TIME_EPSILON
+
+    def record_frame(self, lateness, work_time):
+        self.lateness.append(lateness)
+        self.work_times.append(work_time)
+        if work_time > self.step_time:
+            self.overruns += 1
+
+    def wall_ticks(self):
+        start_time = self.clock()
+        index = 0
+        while self.in_duration(index * self.step_time):
+            deadline = start_time + index * self.step_time
+            sleep_time = deadline - self.clock()
+            if sleep_time > 0:
+                self.sleep(sleep_time)
+            sample_time = self.clock()
+            # 只有需要快照时才请求，避免每帧多一次 RPC
+            snapshot = self.world.get_snapshot() if self.want_snapshot and self.world is not None else None
+            yield sample_time - start_time, snapshot
+            end_time = self.clock()
+            self.record_frame(max(0.0, sample_time - deadline), end_time - sample_time)
+            index += 1
+            if self.policy == 'skip':
+                # 最近一个已经过去的时间点，更早的时间点不再补采
+                latest = int((end_time - start_time) // self.step_time)
+                if latest > index:
+                    self.skipped += latest - index
+                    index = latest
+
+    def sync_ticks(self):
+        # 仿真按物理允许的步长 delta 前进，每 round(step_time / delta) 次 tick 采样一次，采集脚本不改变仿真本身
+        settings = self.world.get_settings()
+        synchronous_mode = settings.synchronous_mode
+        fixed_delta_seconds = settings.fixed_delta_seconds
+        delta = get_sync_delta(settings, self.step_time)
+        ticks_per_sample = max(1, round(self.step_time / delta))
+        settings.synchronous_mode = True
+        settings.fixed_delta_seconds = delta
+        self.world.apply_settings(settings)
+        if self.traffic_manager is not None:
+            # 同步模式下 Traffic Manager 也必须同步，否则自动驾驶的车辆与仿真帧不同步
+            self.traffic_manager.set_synchronous_mode(True)
+        try:
+            start_time = None
+            while True:
+                for _ in range(ticks_per_sample):
+                    self.world.tick()
+                snapshot = self.world.get_snapshot()
+                elapsed_seconds = snapshot.timestamp.elapsed_seconds
+                if start_time is None:
+                    start_time = elapsed_seconds
+                pt = elapsed_seconds - start_time
+                if not self.in_duration(pt):
+                    return
+                sample_time = self.clock()
+                yield pt, snapshot
+                self.record_frame(0.0, self.clock() - sample_time)
+        finally:
+            # 退出时恢复原来的设置，否则服务器和 Traffic Manager 会一直等待 tick
+            if self.traffic_manager is not None:
+                self.traffic_manager.set_synchronous_mode(synchronous_mode)
+            settings = self.world.get_settings()
+            settings.synchronous_mode = synchronous_mode
+            settings.fixed_delta_seconds = fixed_delta_seconds
+            self.world.apply_settings(settings)
+
+    def on_tick_ticks(self):
+        # 回调在 CARLA 的线程中执行，只有一个位置的队列：采集循环还没取走上一帧时新的帧被跳过
+        frames = queue.Queue(maxsize=1)
+        state = {'start_time': None, 'next_index': 0}
+
+        def on_tick(snapshot):
+            elapsed_seconds = snapshot.timestamp.elapsed_seconds
+            if state['start_time'] is None:
+                state['start_time'] = elapsed_seconds
+            pt = elapsed_seconds - state['start_time']
+            index = int(math.floor(pt / self.step_time + TIME_EPSILON))
+            if index < state['next_index']:
+                return
+            self.skipped += index - state['next_index']
+            state['next_index'] = index + 1
+            try:
+                frames.put_nowait((pt, pt - index * self.step_time, snapshot))
+            except queue.Full:
+                self.skipped += 1
+
+        callback_id = self.world.on_tick(on_tick)
+        try:
+            while True:
+                try:
+                    pt, lateness, snapshot = frames.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise RuntimeError(f"{self.timeout}s 内没有收到仿真帧") from None
+                if not self.in_duration(pt):
+                    return
+                sample_time = self.clock()
+                yield pt, snapshot
+                self.record_frame(lateness, self.clock() - sample_time)
+        finally:
+            self.world.remove_on_tick(callback_id)
+
+    def stats(self):
+        frames = len(self.work_times)
+        return {
+            'frames': frames,
+            'skipped': self.skipped,
+            'overruns': self.overruns,
+            'mean_work_time': sum(self.work_times) / frames if frames else 0.0,
+            'max_work_time': max(self.work_times, default=0.0),
+            'mean_lateness': sum(self.lateness) / frames if frames else 0.0,
+            'max_lateness': max(self.lateness, default=0.0),
+        }
+
+
+def format_tick_stats(scheduler):
+    stats = scheduler.stats()
+    return (f"frames: {stats['frames']}, skipped: {stats['skipped']}, overruns: {stats['overruns']}, "
+            f"work time: {stats['mean_work_time']:.3f}s (max {stats['max_work_time']:.3f}s), "
+            f"lateness: {stats['mean_lateness']:.3f}s (max {stats['max_lateness']:.3f}s)")